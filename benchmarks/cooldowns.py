@@ -0,0 +1,59 @@
+"""
+Drives `CurrencyCooldownMap.try_use_normal` and `try_use_stream` with a synthetic
+stream of chat messages on a simulated clock.
+
+    python -m benchmarks.cooldowns [messages] [chatters]
+"""
+
+import random
+import sys
+import time
+
+from models.currency import CurrencyCooldown, CurrencyCooldownMap
+
+# simulated seconds between consecutive messages
+MESSAGE_SPACING = 0.05
+STREAM_SHARE = 0.3
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def main(messages: int, chatters: int):
+    rng = random.Random(0)
+    # a few chatters are responsible for most messages
+    authors = [int(chatters * rng.random() ** 3) for _ in range(messages)]
+    in_stream = [rng.random() < STREAM_SHARE for _ in range(messages)]
+
+    clock = SimulatedClock()
+    cooldowns = CurrencyCooldownMap(clock)
+    accepted = 0
+    largest_map = 0
+
+    start = time.perf_counter()
+    for author, stream in zip(authors, in_stream):
+        clock.now += MESSAGE_SPACING
+        if stream:
+            accepted += cooldowns.try_use_stream(author) != "blocked"
+        else:
+            accepted += cooldowns.try_use_normal(author)
+        largest_map = max(largest_map, len(cooldowns.map))
+    elapsed = time.perf_counter() - start
+
+    print(f"{messages} messages over {clock.now / 3600:.1f} simulated hours")
+    print(f"{elapsed:.2f}s, {elapsed / messages * 1e6:.2f} µs/message")
+    print(f"{accepted} accruals, at most {largest_map} cooldowns held")
+    entry_size = sys.getsizeof(CurrencyCooldown(0.0))
+    print(f"{entry_size} bytes per cooldown entry")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50_000,
+    )
@@ -0,0 +1,79 @@
+"""
+Measures write and read throughput of the currency and prediction workloads
+under each of `database.ENGINE_PROFILES`.
+
+    python -m benchmarks.engine_profiles [operations]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import database
+import database.currency as currency
+import database.predictions as predictions
+from database.migrations import run_migrations
+
+USERS = 500
+PREDICTION_ID = 1
+
+
+def _throughput(operations: int, fn: Callable[[int], object]) -> float:
+    start = time.perf_counter()
+    for i in range(operations):
+        fn(i)
+    return operations / (time.perf_counter() - start)
+
+
+def _read_points(user_id: int) -> int:
+    # the balance cache would otherwise answer every read without the database
+    with currency._flush_lock:
+        currency.balance_cache.clear()
+    return currency.get_user_points(user_id)
+
+
+def bench_profile(profile: str, directory: Path, operations: int):
+    engine = database.configure(
+        url=f"sqlite:///{directory / f'{profile}.db'}", profile=profile
+    )
+    run_migrations(engine)
+    predictions.create_prediction(PREDICTION_ID, "bench", "a", "b")
+
+    results = {
+        "currency write": _throughput(
+            operations,
+            lambda i: currency.add_points_to_user(i % USERS, 10, "benchmark"),
+        ),
+        "currency read": _throughput(operations, lambda i: _read_points(i % USERS)),
+        "prediction vote": _throughput(
+            operations,
+            lambda i: predictions.add_prediction_vote(
+                PREDICTION_ID,
+                i % USERS,
+                predictions.PredictionChoice.A
+                if i % 2
+                else predictions.PredictionChoice.B,
+                1,
+            ),
+        ),
+        "prediction read": _throughput(
+            operations // 10, lambda _: predictions.get_prediction(PREDICTION_ID)
+        ),
+    }
+    engine.dispose()
+    return results
+
+
+def main(operations: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in database.ENGINE_PROFILES:
+            results = bench_profile(profile, Path(tmp), operations)
+            print(f"[{profile}]")
+            for workload, ops in results.items():
+                print(f"{workload:>16}: {ops:10.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,70 @@
+"""
+Measures paying out a prediction with many votes, comparing one
+`add_points_to_user` commit per winning vote with `pay_out_prediction`,
+which settles everything in one transaction.
+
+    python -m benchmarks.prediction_payout [votes]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import insert
+
+import database
+import database.predictions as predictions
+from database import Prediction, PredictionChoice, PredictionVote
+from database.currency import add_points_to_user, add_points_to_users
+from database.migrations import run_migrations
+
+
+def seed(url: str, votes: int):
+    engine = database.configure(url=url)
+    run_migrations(engine)
+    add_points_to_users(range(votes), 1000, "seed")
+    predictions.create_prediction(1, "bench", "a", "b")
+    rows = [
+        {
+            "prediction": 1,
+            "user_id": user_id,
+            "amount": 1 + user_id % 100,
+            "choice": PredictionChoice.A if user_id % 2 else PredictionChoice.B,
+        }
+        for user_id in range(votes)
+    ]
+    # votes are inserted in bulk; placing them one by one is not what is measured
+    with database.make_session() as session, session.begin():
+        session.execute(insert(PredictionVote), rows)
+        prediction = session.get(Prediction, 1)
+        assert prediction is not None
+        for row in rows:
+            if row["choice"] == PredictionChoice.A:
+                prediction.total_a += row["amount"]
+            else:
+                prediction.total_b += row["amount"]
+    predictions.close_prediction(1)
+    return engine
+
+
+def main(votes: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        seed(f"sqlite:///{Path(tmp) / 'per_vote.db'}", votes)
+        with database.make_session() as session:
+            winning = session.query(PredictionVote).filter_by(choice=PredictionChoice.A)
+            rewards = [(vote.user_id, vote.amount * 2) for vote in winning]
+        start = time.perf_counter()
+        for user_id, reward in rewards:
+            add_points_to_user(user_id, reward, "prediction 1 payout")
+        print(f"{'commit per vote':>20}: {time.perf_counter() - start:8.3f} s")
+
+        engine = seed(f"sqlite:///{Path(tmp) / 'set_based.db'}", votes)
+        start = time.perf_counter()
+        predictions.pay_out_prediction(1, PredictionChoice.A)
+        print(f"{'one transaction':>20}: {time.perf_counter() - start:8.3f} s")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,44 @@
+"""
+Measures the per-call overhead of `database.make_session` for a primary-key read,
+comparing the old behaviour (`create_all` on every session) with sessions handed
+out after a one-time migration.
+
+    python -m benchmarks.session_overhead [iterations]
+"""
+
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+import database
+from database import CurrencyInfo
+from database.migrations import run_migrations
+from database.models import Base
+
+
+def main(iterations: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = database.configure(url=f"sqlite:///{Path(tmp) / 'bench.db'}")
+        run_migrations(engine)
+
+        def create_all_per_call():
+            Base.metadata.create_all(engine)
+            with database.make_session() as session:
+                session.get(CurrencyInfo, 1)
+
+        def session_only():
+            with database.make_session() as session:
+                session.get(CurrencyInfo, 1)
+
+        for name, fn in [
+            ("create_all per call", create_all_per_call),
+            ("migrated once", session_only),
+        ]:
+            seconds = min(timeit.repeat(fn, number=iterations, repeat=3))
+            print(f"{name:>20}: {seconds / iterations * 1e6:8.1f} µs/call")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
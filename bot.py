@@ -10,6 +10,8 @@ from cogs.robomoji import RobomojiCog
 from cogs.sync import mk_sync
 from cogs.underpeel import Underpeel
 from config import CONFIG, SECRETS
+import database
+from database.migrations import run_migrations
 from models.bot import Bot
 
 
@@ -23,6 +25,9 @@ async def main():
     else:
         discord.utils.setup_logging()
 
+    database.configure(**CONFIG.get("database", {}))
+    run_migrations(database.engine)
+
     await bot.add_cog(CommandErrorHandler(bot))
     await bot.add_cog(RobomojiCog(bot))
     await bot.add_cog(CurrencyCog(bot))
@@ -30,7 +35,9 @@ async def main():
     bot.tree.add_command(mk_sync(bot))
     bot.tree.add_command(Underpeel(bot))
 
-    await bot.start(SECRETS["DISCORD_TOKEN"])
+    # closing the bot unloads the cogs, which flushes any buffered state
+    async with bot:
+        await bot.start(SECRETS["DISCORD_TOKEN"])
 
 
 if __name__ == "__main__":
@@ -1,7 +1,7 @@
 import logging
-from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import Literal
+from datetime import timedelta
+from pathlib import Path
+from typing import Sequence
 
 from discord import (
     AllowedMentions,
@@ -10,13 +10,18 @@ from discord import (
     Interaction,
     Member,
     Message,
+    Role,
     app_commands,
 )
 from discord.ext import commands, tasks
 
 import database.currency as db
+from database import to_thread
+from database.ledger import ARCHIVE_DIR, compact_ledger_month, reconcile_balances
 from config import CONFIG
 from models.bot import Bot
+from models.currency import CurrencyCooldownMap
+from views.history import HistoryCursor, HistoryPager
 
 LOG = logging.getLogger(__name__)
 
@@ -26,87 +31,22 @@ management_check = app_commands.checks.has_any_role(
     CONFIG["dev_role_id"],
 )
 
-ACCRUAL_COOLDOWN = timedelta(minutes=10)
-ACCUMULATION_DELAY = timedelta(minutes=10)
 ACCRUAL_CURRENCY_AMOUNT = 1
 STREAM_CHAT_MULTIPLIER = 10
-
-
-@dataclass
-class CurrencyCooldown:
-    """
-    based off of discord.py's Cooldown class
-    """
-
-    window: datetime
-    in_stream: bool = False
-
-    def _try_use(self) -> bool:
-        """
-        returns whether cooldown was used and updated
-        """
-        now = datetime.now()
-        if self.window + ACCRUAL_COOLDOWN < now:
-            if now < self.window + ACCRUAL_COOLDOWN + ACCUMULATION_DELAY:
-                self.window += ACCRUAL_COOLDOWN
-            else:
-                self.window = now
-            return True
-        return False
-
-    def try_use_normal(self) -> bool:
-        """
-        returns whether cooldown was used and updated
-        """
-        if self._try_use():
-            self.in_stream = False
-            return True
-        return False
-
-    def try_use_stream(self) -> Literal["blocked", "promoted", "accepted"]:
-        if self._try_use():
-            self.in_stream = True
-            return "accepted"
-        elif not self.in_stream:
-            self.in_stream = True
-            return "promoted"
-        return "blocked"
-
-
-class CurrencyCooldownMap:
-    def __init__(self) -> None:
-        self.map: dict[int, CurrencyCooldown] = {}
-
-    def _clean_cache(self):
-        def cutoff(t: datetime) -> datetime:
-            return t + ACCRUAL_COOLDOWN + ACCUMULATION_DELAY
-
-        dead_keys = [
-            k for (k, v) in self.map.items() if datetime.now() > cutoff(v.window)
-        ]
-        for k in dead_keys:
-            del self.map[k]
-
-    def try_use_normal(self, member: Member) -> bool:
-        if member.id not in self.map:
-            self.map[member.id] = CurrencyCooldown(datetime.now())
-            return True
-        return self.map[member.id].try_use_normal()
-
-    def try_use_stream(
-        self, member: Member
-    ) -> Literal["blocked", "promoted", "accepted"]:
-        if member.id not in self.map:
-            self.map[member.id] = CurrencyCooldown(datetime.now(), in_stream=True)
-            return "accepted"
-        return self.map[member.id].try_use_stream()
+ACCRUAL_FLUSH_INTERVAL = timedelta(seconds=5)
+LEDGER_HORIZON = timedelta(days=CONFIG.get("ledger_horizon_days", 90))
+LEDGER_ARCHIVE_DIR = Path(CONFIG.get("ledger_archive_dir", ARCHIVE_DIR))
 
 
 def _display_currency_transaction(transaction: db.CurrencyTransaction) -> str:
     beginning_amount = transaction.end_amount - transaction.delta
+    timestamp = f"<t:{round(transaction.time.timestamp())}>"
+    if transaction.period_start is not None:
+        # summary of archived transactions
+        timestamp = f"<t:{round(transaction.period_start.timestamp())}> – {timestamp}"
     return "".join(
         [
-            f"**<t:{round(transaction.time.timestamp())}>: ",
+            f"**{timestamp}: ",
             f"{beginning_amount}{transaction.delta:+}→{transaction.end_amount}**\n",
             transaction.reason,
         ]
@@ -120,12 +60,26 @@ class CurrencyCog(commands.GroupCog, group_name="currency"):
         self.bot = bot
         self.cooldowns = CurrencyCooldownMap()
         self.clear_cooldown_cache.start()
+        self.flush_accruals.start()
+        self.archive_old_transactions.start()
+        self.check_balances.start()
 
         assert self.app_command is not None
         self.app_command.add_command(CurrencyStaff())
 
+    async def cog_load(self):
+        await to_thread(db.get_leaderboard)
+
     async def cog_unload(self):
         self.clear_cooldown_cache.cancel()
+        self.flush_accruals.cancel()
+        self.archive_old_transactions.cancel()
+        self.check_balances.cancel()
+        # the bot closing swallows anything raised here
+        try:
+            await to_thread(db.flush_pending_points)
+        except Exception:
+            LOG.exception("could not flush accrued currency on unload")
 
     @commands.Cog.listener()
     async def on_message(self, message: Message):
@@ -136,39 +90,42 @@ class CurrencyCog(commands.GroupCog, group_name="currency"):
         if not isinstance(message.author, Member):
             return
         if message.channel.id == CONFIG["stream_chat_id"]:
-            match self.cooldowns.try_use_stream(message.author):
+            match self.cooldowns.try_use_stream(message.author.id):
                 case "accepted":
                     amount = ACCRUAL_CURRENCY_AMOUNT * STREAM_CHAT_MULTIPLIER
                 case "promoted":
                     amount = ACCRUAL_CURRENCY_AMOUNT * (STREAM_CHAT_MULTIPLIER - 1)
                 case "blocked":
                     return
-            db.add_points_to_user(message.author.id, amount)
+            db.queue_points_for_user(message.author.id, amount)
             return
-        if self.cooldowns.try_use_normal(message.author):
-            db.add_points_to_user(message.author.id, ACCRUAL_CURRENCY_AMOUNT)
+        if self.cooldowns.try_use_normal(message.author.id):
+            db.queue_points_for_user(message.author.id, ACCRUAL_CURRENCY_AMOUNT)
 
     @app_commands.command(name="balance")
     async def check_balance(self, interaction: Interaction):
-        peels = db.get_user_points(interaction.user.id)
+        peels = await to_thread(db.get_user_points, interaction.user.id)
         peel_plural = "peel" if peels == 1 else "peels"
         await interaction.response.send_message(
             f"You have {peels} {peel_plural}.",
             ephemeral=True,
         )
 
-    @app_commands.command(name="history")
-    async def transaction_history(self, interaction: Interaction, member: Member):
-        LIMIT = 15
-        history = db.get_currency_transactions(member.id, LIMIT)
-        if len(history) == 0:
-            description = "No transactions found."
+    @app_commands.command(name="leaderboard")
+    async def leaderboard(self, interaction: Interaction):
+        LIMIT = 10
+        top = await to_thread(db.get_leaderboard, LIMIT)
+        if len(top) == 0:
+            description = "Nobody has any peels yet."
         else:
             description = "\n".join(
-                [_display_currency_transaction(transaction) for transaction in history]
+                f"{rank}. <@{user_id}>: {amount}"
+                for rank, (user_id, amount) in enumerate(top, start=1)
             )
+        if (rank := await to_thread(db.get_rank, interaction.user.id)) is not None:
+            description += f"\n\nYou are #{rank}."
         embed = Embed(
-            title=f"most recent transactions for {member.name}",
+            title="peel leaderboard",
             description=description,
             color=Color.gold(),
         )
@@ -178,9 +135,71 @@ class CurrencyCog(commands.GroupCog, group_name="currency"):
             allowed_mentions=AllowedMentions.none(),
         )
 
+    @app_commands.command(name="history")
+    async def transaction_history(self, interaction: Interaction, member: Member):
+        async def fetch(before: HistoryCursor | None, limit: int):
+            return await to_thread(
+                db.get_currency_transactions, member.id, limit, before
+            )
+
+        def render(history: Sequence[db.CurrencyTransaction]) -> Embed:
+            if len(history) == 0:
+                description = "No transactions found."
+            else:
+                description = "\n".join(
+                    [
+                        _display_currency_transaction(transaction)
+                        for transaction in history
+                    ]
+                )
+            return Embed(
+                title=f"most recent transactions for {member.name}",
+                description=description,
+                color=Color.gold(),
+            )
+
+        pager = HistoryPager(interaction.user.id, fetch, render)
+        await pager.send(interaction, ephemeral=True)
+
     @tasks.loop(hours=1)
     async def clear_cooldown_cache(self):
         self.cooldowns._clean_cache()
+        LOG.info(f"{db.balance_cache}")
+
+    @tasks.loop(seconds=ACCRUAL_FLUSH_INTERVAL.total_seconds())
+    async def flush_accruals(self):
+        # tasks.loop stops on anything but network errors; the deltas were put
+        # back, so keep the loop alive to retry them on the next tick
+        try:
+            await to_thread(db.flush_pending_points)
+        except Exception:
+            LOG.exception("could not flush accrued currency")
+
+    @tasks.loop(hours=1)
+    async def check_balances(self):
+        try:
+            divergences = await to_thread(reconcile_balances)
+        except Exception:
+            # keep the loop alive; the checkpoint did not move
+            LOG.exception("could not reconcile balances")
+            return
+        for divergence in divergences:
+            LOG.warning(
+                f"balance of {divergence.user_id} is {divergence.amount} "
+                f"but the ledger says {divergence.expected}"
+            )
+
+    @tasks.loop(hours=24)
+    async def archive_old_transactions(self):
+        # compaction rolls back on failure; keep the loop alive to try again
+        try:
+            # one month per call so other database work runs in between
+            while await to_thread(
+                compact_ledger_month, LEDGER_HORIZON, LEDGER_ARCHIVE_DIR
+            ):
+                pass
+        except Exception:
+            LOG.exception("could not archive old currency transactions")
 
 
 @app_commands.guilds(CONFIG["discord_server_id"])
@@ -188,7 +207,7 @@ class CurrencyStaff(app_commands.Group, name="staff"):
     @app_commands.command(name="balance")
     @management_check
     async def check_balance(self, interaction: Interaction, member: Member):
-        peels = db.get_user_points(member.id)
+        peels = await to_thread(db.get_user_points, member.id)
         peel_plural = "peel" if peels == 1 else "peels"
         await interaction.response.send_message(
             f"{member.mention} has {peels} {peel_plural}.",
@@ -202,10 +221,37 @@ class CurrencyStaff(app_commands.Group, name="staff"):
         self, interaction: Interaction, member: Member, amount: int
     ):
         reason = f"{interaction.user} ({interaction.user.id}) gave {member} ({member.id}) {amount} peels"
-        new_amount = db.add_points_to_user(member.id, amount, reason)
+        new_amount = await to_thread(db.add_points_to_user, member.id, amount, reason)
         LOG.info(reason)
         await interaction.response.send_message(
             f"Added {amount} to {member.mention}'s balance. They now have {new_amount}.",
             allowed_mentions=AllowedMentions.none(),
             ephemeral=True,
         )
+
+    @app_commands.command(name="give_role")
+    @management_check
+    async def give_currency_to_role(
+        self, interaction: Interaction, role: Role, amount: int
+    ):
+        members = [member for member in role.members if not member.bot]
+        if len(members) == 0:
+            await interaction.response.send_message(
+                f"{role.mention} has no members.",
+                allowed_mentions=AllowedMentions.none(),
+                ephemeral=True,
+            )
+            return
+        reason = (
+            f"{interaction.user} ({interaction.user.id}) gave {amount} peels "
+            f"to each member of {role.name} ({role.id})"
+        )
+        new_amounts = await to_thread(
+            db.add_points_to_users, [member.id for member in members], amount, reason
+        )
+        LOG.info(f"{reason}: {len(new_amounts)} members")
+        await interaction.response.send_message(
+            f"Added {amount} to the balance of {len(new_amounts)} members of {role.mention}.",
+            allowed_mentions=AllowedMentions.none(),
+            ephemeral=True,
+        )
@@ -1,4 +1,5 @@
-import re
+import logging
+
 from discord import (
     Interaction,
     TextChannel,
@@ -8,16 +9,21 @@ from discord import (
 from discord.ext import commands
 
 import database.predictions as db
+from database import to_thread
 from config import CONFIG
 from models.bot import Bot
 from models.prediction import PredictionInfo
 from views.prediction import (
-    PredictionAmountPrompt,
+    PredictionChoiceButton,
     PredictionCloseControls,
     PredictionPayoutControls,
     PredictionView,
+    prediction_digest,
+    prediction_renderer,
 )
 
+LOG = logging.getLogger(__name__)
+
 management_check = app_commands.checks.has_any_role(
     CONFIG["board_role_id"],
     CONFIG["mod_role_id"],
@@ -31,6 +37,20 @@ class PredictionsCog(commands.GroupCog, group_name="prediction"):
         super().__init__()
         self.bot = bot
 
+    async def cog_load(self):
+        await to_thread(db.load_live_predictions)
+        for divergence in await to_thread(db.check_prediction_totals):
+            LOG.warning(
+                f"prediction {divergence.message_id} has {divergence.total} on "
+                f"{divergence.choice} but its votes add up to {divergence.expected}"
+            )
+        self.bot.add_dynamic_items(PredictionChoiceButton)
+
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(PredictionChoiceButton)
+        await prediction_renderer.drain()
+        await prediction_digest.drain()
+
     @app_commands.command(name="create")
     @management_check
     async def start_prediction(
@@ -47,7 +67,7 @@ class PredictionsCog(commands.GroupCog, group_name="prediction"):
             )
             return
         message = await channel.send("creating prediction")
-        db.create_prediction(message.id, title, choice_a, choice_b)
+        await to_thread(db.create_prediction, message.id, title, choice_a, choice_b)
 
         info = PredictionInfo(
             message=message,
@@ -81,15 +101,18 @@ class PredictionsCog(commands.GroupCog, group_name="prediction"):
             )
             return
         assert thread.starter_message is not None
-        prediction = db.get_prediction(thread.starter_message.id)
-        if prediction is None:
-            await interaction.response.send_message(
-                "This thread is not a prediction thread",
-                ephemeral=True,
-            )
-            return
-        info = PredictionInfo.from_db(prediction, thread.starter_message)
-        match prediction.status:
+        if (live := db.get_live_prediction(thread.starter_message.id)) is not None:
+            info = PredictionInfo.from_live(live, thread.starter_message)
+        else:
+            prediction = await to_thread(db.get_prediction, thread.starter_message.id)
+            if prediction is None:
+                await interaction.response.send_message(
+                    "This thread is not a prediction thread",
+                    ephemeral=True,
+                )
+                return
+            info = PredictionInfo.from_db(prediction, thread.starter_message)
+        match info.status:
             case db.PredictionStatus.OPEN:
                 await interaction.response.send_message(
                     view=PredictionCloseControls(info),
@@ -110,42 +133,3 @@ class PredictionsCog(commands.GroupCog, group_name="prediction"):
                     "prediction has been refunded",
                     ephemeral=True,
                 )
-
-    @commands.Cog.listener()
-    async def on_interaction(self, interaction: Interaction):
-        if interaction.data is None:
-            return
-        button_id = interaction.data.get("custom_id")
-        if not isinstance(button_id, str):
-            return
-        pattern = re.compile(
-            r"up_prediction:(?P<message_id>\d+):(?P<prediction_choice_id>[ab])"
-        )
-        if (match := pattern.fullmatch(button_id)) is None:
-            # interaction is not of interest
-            return
-        message_id = int(match["message_id"])
-        choice = (
-            db.PredictionChoice.A
-            if match["prediction_choice_id"] == "a"
-            else db.PredictionChoice.B
-        )
-
-        prediction = db.get_prediction(message_id)
-        assert prediction is not None
-        if prediction is None:
-            await interaction.response.send_message(
-                "could not find prediction", ephemeral=True
-            )
-            return
-
-        assert interaction.message is not None
-        info = PredictionInfo.from_db(prediction, interaction.message)
-        await interaction.response.send_modal(
-            PredictionAmountPrompt(
-                info,
-                choice,
-                user_balance=db.get_user_points(interaction.user.id),
-            )
-        )
-        return
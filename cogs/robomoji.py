@@ -1,27 +1,34 @@
-from datetime import datetime, timedelta
+from datetime import timedelta
 import logging
+from typing import Sequence
 
 from discord import (
     AllowedMentions,
-    ForumChannel,
-    HTTPException,
+    Color,
+    Embed,
+    Emoji,
+    Guild,
     Interaction,
     Member,
     Message,
-    TextChannel,
-    Thread,
-    StageChannel,
-    VoiceChannel,
+    PartialEmoji,
     app_commands,
 )
-from discord.ext import commands
+from discord.abc import GuildChannel
+from discord.app_commands import Range
+from discord.ext import commands, tasks
 
 from config import CONFIG
 import database.robomoji as db
+from database import to_thread
+from models.channel_policy import ChannelPolicy
+from models.robomoji import GuildEmojiIndex, ReactionDispatcher
+from views.history import HistoryCursor, HistoryPager
 
 LOG = logging.getLogger(__name__)
 
 ROBOMOJI_COOLDOWN = timedelta(seconds=30)
+ROBOMOJI_FLUSH_INTERVAL = timedelta(minutes=5)
 management_check = app_commands.checks.has_any_role(
     CONFIG["board_role_id"],
     CONFIG["mod_role_id"],
@@ -49,6 +56,24 @@ def _display_robomoji_transaction(transaction: db.RobomojiTransaction) -> str:
 class RobomojiCog(commands.GroupCog, group_name="robomoji"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.reactions = ReactionDispatcher(self.remove_missing_emojis)
+        self.guild_emojis = GuildEmojiIndex()
+        self.channel_policy = ChannelPolicy(
+            CONFIG["non_robomoji_channels"], CONFIG["non_robomoji_categories"]
+        )
+
+    async def cog_load(self):
+        await to_thread(db.load_emoji_index)
+        self.flush_emoji_uses.start()
+
+    async def cog_unload(self):
+        self.flush_emoji_uses.cancel()
+        await self.reactions.drain()
+        # the bot closing swallows anything raised here
+        try:
+            await to_thread(db.flush_emoji_uses)
+        except Exception:
+            LOG.exception("could not flush robomoji uses on unload")
 
     @commands.Cog.listener()
     async def on_message(self, message: Message):
@@ -57,45 +82,60 @@ class RobomojiCog(commands.GroupCog, group_name="robomoji"):
         if message.guild.id != CONFIG["discord_server_id"]:
             return
 
-        channel = message.channel
-        if isinstance(channel, Thread):
-            channel = channel.parent
-            assert channel is not None
-
-        match channel:
-            case TextChannel() | StageChannel() | VoiceChannel() | ForumChannel():
-                if channel.id in CONFIG["non_robomoji_channels"]:
-                    return
-                if channel.category_id in CONFIG["non_robomoji_categories"]:
-                    return
-            case _:
-                LOG.info("tried to robomoji in bad {channel=}")
+        if not self.channel_policy.allows(message.channel):
+            return
 
         author_id = message.author.id
-        emoji_info = db.get_emoji_info(author_id)
-        if emoji_info is None:
+        # empty if they have no robomojis or it's too soon to react again
+        emojis = db.use_emojis(author_id, ROBOMOJI_COOLDOWN)
+        self.reactions.dispatch(message, emojis)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_create(self, channel: GuildChannel):
+        self.channel_policy.invalidate()
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before: GuildChannel, after: GuildChannel):
+        self.channel_policy.invalidate()
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: GuildChannel):
+        self.channel_policy.invalidate()
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(
+        self, guild: Guild, before: Sequence[Emoji], after: Sequence[Emoji]
+    ):
+        if guild.id != CONFIG["discord_server_id"]:
             return
-        if len(emoji_info.robomojis) == 0:
+        self.guild_emojis.update(after)
+        deleted_ids = {emoji.id for emoji in before} - {emoji.id for emoji in after}
+        if not deleted_ids:
             return
-        if (
-            emoji_info.last_reacted is not None
-            and emoji_info.last_reacted + ROBOMOJI_COOLDOWN > datetime.now()
-        ):
-            # too soon, don't add reactions
+        deleted = {
+            emoji
+            for emoji in db.get_all_cached_emojis()
+            if PartialEmoji.from_str(emoji).id in deleted_ids
+        }
+        if not deleted:
             return
-        db.register_emoji_use(author_id)
-        for robomoji in emoji_info.robomojis:
-            try:
-                await message.add_reaction(robomoji.emoji)
-            except HTTPException as e:
-                if e.code == 10014 or (e.code == 50035 and "emoji_id" in e.text):
-                    LOG.error(
-                        f"emoji '{robomoji.emoji}' for {message.author.id}({message.author.name}) "
-                        f"does not exist. removing from database.",
-                    )
-                    db.toggle_emoji(
-                        "SYSTEM", author_id, robomoji.emoji, "bot could not find emoji"
-                    )
+        removed = await to_thread(
+            db.remove_emojis_everywhere, deleted, "emoji was deleted from the server"
+        )
+        for user_id, emojis in removed.items():
+            LOG.info(f"removed deleted emojis {emojis} from {user_id}")
+
+    async def remove_missing_emojis(self, message: Message, emojis: list[str]):
+        LOG.error(
+            f"emojis {emojis} for {message.author.id}({message.author.name}) "
+            f"do not exist. removing from database.",
+        )
+        await to_thread(
+            db.remove_missing_emojis,
+            message.author.id,
+            emojis,
+            "bot could not find emoji",
+        )
 
     @app_commands.command(name="toggle")
     @management_check
@@ -111,7 +151,21 @@ class RobomojiCog(commands.GroupCog, group_name="robomoji"):
         emoji: str,
         reason: str,
     ):
-        action = db.toggle_emoji(interaction.user.id, member.id, emoji, reason)
+        if not self.guild_emojis.loaded:
+            assert interaction.guild is not None
+            self.guild_emojis.update(interaction.guild.emojis)
+        robomojis = db.get_cached_emojis(member.id)
+        is_removal = robomojis is not None and emoji in robomojis.emojis
+        if not is_removal and not self.guild_emojis.is_usable(emoji):
+            await interaction.response.send_message(
+                f"{emoji} is not a unicode emoji or an emoji of this server",
+                allowed_mentions=AllowedMentions.none(),
+                ephemeral=True,
+            )
+            return
+        action = await to_thread(
+            db.toggle_emoji, interaction.user.id, member.id, emoji, reason
+        )
         act_preposition = "to" if action.value == "added" else "from"
         LOG.info(
             f"{interaction.user} {action} robomoji {emoji} "
@@ -128,7 +182,7 @@ class RobomojiCog(commands.GroupCog, group_name="robomoji"):
         member="member to describe emojis for",
     )
     async def list_emoji(self, interaction: Interaction, member: Member):
-        emoji_info = db.get_emoji_info(member.id)
+        emoji_info = await to_thread(db.get_emoji_info, member.id)
         if emoji_info is None or len(emoji_info.robomojis) == 0:
             await interaction.response.send_message(f"{member.name} has no robomojis")
             return
@@ -140,16 +194,38 @@ class RobomojiCog(commands.GroupCog, group_name="robomoji"):
     @management_check
     @app_commands.describe(
         member="member to get emoji history for",
-        limit="how many transactions to display (default: 15)",
+        limit="how many transactions to display per page (default: 15)",
     )
     async def emoji_history(
-        self, interaction: Interaction, member: Member, limit: int = 15
+        self, interaction: Interaction, member: Member, limit: Range[int, 1, 25] = 15
     ):
-        history = db.get_emoji_changes(member.id, limit)
-        response = [
-            f"here are the most recent robomoji commands for {member.name}:",
-            *(_display_robomoji_transaction(transaction) for transaction in history),
-        ]
-        await interaction.response.send_message(
-            "\n".join(response), allowed_mentions=AllowedMentions.none()
-        )
+        async def fetch(before: HistoryCursor | None, limit: int):
+            return await to_thread(db.get_emoji_changes, member.id, limit, before)
+
+        def render(history: Sequence[db.RobomojiTransaction]) -> Embed:
+            # a full page is longer than a message's content allows
+            if len(history) == 0:
+                description = "No robomoji commands found."
+            else:
+                description = "\n".join(
+                    [
+                        _display_robomoji_transaction(transaction)
+                        for transaction in history
+                    ]
+                )
+            return Embed(
+                title=f"most recent robomoji commands for {member.name}",
+                description=description,
+                color=Color.blurple(),
+            )
+
+        pager = HistoryPager(interaction.user.id, fetch, render, page_size=limit)
+        await pager.send(interaction)
+
+    @tasks.loop(seconds=ROBOMOJI_FLUSH_INTERVAL.total_seconds())
+    async def flush_emoji_uses(self):
+        # the uses were put back; keep the loop alive to retry them
+        try:
+            await to_thread(db.flush_emoji_uses)
+        except Exception:
+            LOG.exception("could not flush robomoji uses")
@@ -10,6 +10,7 @@ from discord.app_commands import Range
 
 from config import CONFIG
 import database.valorant as db
+from database import to_thread
 from models.valorant import RiotId
 
 LOG = logging.getLogger(__name__)
@@ -48,7 +49,7 @@ async def link(interaction: Interaction, riot_id: Range[str, 7]):
             await interaction.response.send_message(error_message, ephemeral=True)
             return
 
-    db.set_riot_id(interaction.user.id, game_name, tag)
+    await to_thread(db.set_riot_id, interaction.user.id, game_name, tag)
     LOG.info(f"{interaction.user} ({interaction.user.id}) linked self to {riot_id}")
     await interaction.response.send_message(
         f"Successfully linked to `{game_name}#{tag}`",
@@ -58,7 +59,7 @@ async def link(interaction: Interaction, riot_id: Range[str, 7]):
 
 @app_commands.command()
 async def unlink(interaction: Interaction):
-    db.clear_riot_id(interaction.user.id)
+    await to_thread(db.clear_riot_id, interaction.user.id)
     LOG.info(f"{interaction.user} ({interaction.user.id}) unlinked their riot id")
     await interaction.response.send_message(
         "Successfully unlinked Riot ID.",
@@ -75,7 +76,7 @@ async def staff_link(interaction: Interaction, player: Member, riot_id: Range[st
         case error_message:
             await interaction.response.send_message(error_message, ephemeral=True)
             return
-    db.set_riot_id(player.id, game_name, tag)
+    await to_thread(db.set_riot_id, player.id, game_name, tag)
     LOG.info(
         f"{interaction.user} ({interaction.user.id}) linked {player} ({player.id}) to {riot_id}"
     )
@@ -89,7 +90,7 @@ async def staff_link(interaction: Interaction, player: Member, riot_id: Range[st
 @app_commands.command(name="unlink")
 @staff_check
 async def staff_unlink(interaction: Interaction, player: Member):
-    db.clear_riot_id(player.id)
+    await to_thread(db.clear_riot_id, player.id)
     LOG.info(
         f"{interaction.user} ({interaction.user.id}) unlinked {player} ({player.id})'s riot id"
     )
@@ -102,7 +103,7 @@ async def staff_unlink(interaction: Interaction, player: Member):
 
 @app_commands.command()
 async def valorant_info(interaction: Interaction, player: Member):
-    riot_id = RiotId.maybe_from_db(db.get_riot_id(player.id))
+    riot_id = RiotId.maybe_from_db(await to_thread(db.get_riot_id, player.id))
     if riot_id is None:
         await interaction.response.send_message(
             "No Riot id found for user",
@@ -13,6 +13,7 @@ from discord import (
 from pydantic import BaseModel, Field
 
 import database.valorant as db
+from database import to_thread
 from config import CONFIG, SECRETS
 from models.bot import Bot
 from models.peelo import (
@@ -165,7 +166,7 @@ def mk_check_eligibility(bot: Bot):
     @staff_check
     async def check_eligibility(interaction: Interaction, player: Member):
         await interaction.response.defer(ephemeral=True)
-        riot_id = RiotId.maybe_from_db(db.get_riot_id(player.id))
+        riot_id = RiotId.maybe_from_db(await to_thread(db.get_riot_id, player.id))
         matches_info = await maybe_get_matches_info(bot.http_session, riot_id)
         role_info = get_role_info(player)
         await interaction.followup.send(
@@ -219,7 +220,9 @@ def mk_check_team_eligibility(bot: Bot):
     ):
         await interaction.response.defer(ephemeral=True)
         players = [player1, player2, player3, player4, player5]
-        maybe_riot_ids = [RiotId.maybe_from_db(db.get_riot_id(p.id)) for p in players]
+        maybe_riot_ids = [
+            RiotId.maybe_from_db(await to_thread(db.get_riot_id, p.id)) for p in players
+        ]
         matches_infos = [
             await maybe_get_matches_info(bot.http_session, riot_id)
             for riot_id in maybe_riot_ids
@@ -1,13 +1,18 @@
+import asyncio
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, ParamSpec, TypeVar
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine, event
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from .models import (
-    Base,
     # re-export
     CurrencyInfo as CurrencyInfo,
     CurrencyTransaction as CurrencyTransaction,
+    CurrencyReconciliation as CurrencyReconciliation,
     RobomojiInfo as RobomojiInfo,
     Robomoji as Robomoji,
     RobomojiTransaction as RobomojiTransaction,
@@ -20,10 +25,106 @@ from .models import (
 
 LOG = logging.getLogger(__name__)
 
-engine = create_engine("sqlite:///sqlite-data/underpeel.db")
+DEFAULT_URL = "sqlite:///sqlite-data/underpeel.db"
+
+# Pragmas applied to every new connection, selected by `profile` in the
+# `[database]` table of config.toml. "default" keeps sqlite's own settings.
+ENGINE_PROFILES: dict[str, dict[str, Any]] = {
+    "default": {},
+    "tuned": {
+        # readers no longer block the writer and vice versa
+        "journal_mode": "WAL",
+        # in WAL mode, only checkpoints fsync; commits stay durable across app crashes
+        "synchronous": "NORMAL",
+        # negative values are in KiB
+        "cache_size": -16_000,
+        "mmap_size": 256 * 1024 * 1024,
+        "busy_timeout": 5_000,
+        "temp_store": "MEMORY",
+    },
+}
+_ALLOWED_PRAGMAS = {
+    "journal_mode",
+    "synchronous",
+    "cache_size",
+    "mmap_size",
+    "busy_timeout",
+    "temp_store",
+}
+
+
+def make_engine(
+    url: str = DEFAULT_URL,
+    profile: str = "default",
+    pragmas: dict[str, Any] | None = None,
+    pool_size: int = 2,
+) -> Engine:
+    """
+    Creates an engine that applies the pragmas of `profile`, overridden by
+    `pragmas`, on every new connection.
+
+    Connections are kept open in a small pool so that the page cache and memory
+    map survive between sessions; almost all queries come from the database
+    thread, so one or two connections are enough.
+    """
+    if profile not in ENGINE_PROFILES:
+        raise ValueError(f"unknown database profile {profile!r}")
+    settings = ENGINE_PROFILES[profile] | (pragmas or {})
+    if unknown := settings.keys() - _ALLOWED_PRAGMAS:
+        raise ValueError(f"unsupported database pragmas {sorted(unknown)}")
+
+    new_engine = create_engine(
+        url, poolclass=QueuePool, pool_size=pool_size, max_overflow=8
+    )
+
+    @event.listens_for(new_engine, "connect")
+    def apply_pragmas(dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            # pragmas cannot take bound parameters
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    return new_engine
+
+
+engine = make_engine()
 _SessionFactory = sessionmaker(bind=engine)
 
 
+def configure(**options) -> Engine:
+    """
+    Replaces the engine used by `make_session`.
+    Takes the same options as `make_engine`, usually from the `[database]` table
+    of config.toml.
+    """
+    global engine
+    old_engine, engine = engine, make_engine(**options)
+    _SessionFactory.configure(bind=engine)
+    old_engine.dispose()
+    return engine
+
+
 def make_session():
-    Base.metadata.create_all(engine)
+    """
+    Hands out a new session. The schema must already have been created with
+    `database.migrations.run_migrations`.
+    """
     return _SessionFactory()
+
+
+# All database work from the bot is funneled through this single thread so that
+# sqlite I/O never blocks the event loop and writes are never contended.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+async def to_thread(fn: Callable[P, T], /, *args: P.args, **kwargs: P.kwargs) -> T:
+    """
+    Runs `fn(*args, **kwargs)` on the database thread and waits for the result.
+    Any of the synchronous functions in this package can be awaited this way.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
@@ -1,38 +1,257 @@
+import bisect
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import func, insert, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
 
-from sqlalchemy import insert, select, update
 from database import make_session, CurrencyInfo, CurrencyTransaction
 
 LOG = logging.getLogger(__name__)
 
+# Accrued currency that has not been written to the database yet.
+# `_pending_lock` guards the dict itself and is only held briefly;
+# `_flush_lock` is held while pending deltas are being written so that readers
+# never observe a delta both in the database and in `_pending` (or in neither).
+_pending: dict[int, int] = {}
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
 
-def get_user_points(user_id: int) -> int:
+BALANCE_CACHE_SIZE = 4096
+
+
+class BalanceCache:
     """
-    Returns the amount of currency in chatter `id`'s wallet.
+    Bounded LRU cache of wallet balances as stored in the database.
+    Every write in this module updates it, so entries are never stale.
+    Must be used while holding `_flush_lock`.
     """
-    with make_session() as session:
-        if (info := session.get(CurrencyInfo, user_id)) is None:
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._balances: OrderedDict[int, int] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._balances)
+
+    def __repr__(self) -> str:
+        return (
+            f"BalanceCache(size={len(self)}/{self.maxsize}, "
+            f"hits={self.hits}, misses={self.misses})"
+        )
+
+    def get(self, user_id: int) -> int | None:
+        if (amount := self._balances.get(user_id)) is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._balances.move_to_end(user_id)
+        return amount
+
+    def put(self, user_id: int, amount: int):
+        self._balances[user_id] = amount
+        self._balances.move_to_end(user_id)
+        if len(self._balances) > self.maxsize:
+            self._balances.popitem(last=False)
+
+    def clear(self):
+        self._balances.clear()
+
+
+balance_cache = BalanceCache(BALANCE_CACHE_SIZE)
+
+LEADERBOARD_CAPACITY = 50
+
+
+class Leaderboard:
+    """
+    The `capacity` largest wallets, kept sorted by descending amount and updated
+    on every balance change.
+    When a wallet drops out of a full leaderboard, nobody knows who should take its
+    place, so the leaderboard is reloaded from the database on the next read.
+    Must be used while holding `_flush_lock`.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.stale = True
+        # sort keys are (-amount, -user_id), matching the order of the amount index
+        self._keys: list[tuple[int, int]] = []
+        self._amounts: dict[int, int] = {}
+
+    def seed(self, rows: list[tuple[int, int]]):
+        """
+        Replaces the contents with `(user_id, amount)` rows,
+        which must be the top wallets in the database.
+        """
+        self._keys = sorted((-amount, -user_id) for user_id, amount in rows)
+        del self._keys[self.capacity :]
+        self._amounts = {-neg_id: -neg_amount for neg_amount, neg_id in self._keys}
+        self.stale = False
+
+    def update(self, user_id: int, amount: int):
+        if self.stale:
+            return
+        key = (-amount, -user_id)
+        if (old_amount := self._amounts.pop(user_id, None)) is not None:
+            was_full = len(self._keys) == self.capacity
+            worst = self._keys[-1]
+            self._keys.remove((-old_amount, -user_id))
+            if was_full and key > worst:
+                # somebody outside the leaderboard might now have more than this wallet
+                self.stale = True
+                return
+        elif len(self._keys) == self.capacity:
+            if key > self._keys[-1]:
+                return
+            _, neg_evicted = self._keys.pop()
+            del self._amounts[-neg_evicted]
+        bisect.insort(self._keys, key)
+        self._amounts[user_id] = amount
+
+    def top(self, n: int) -> list[tuple[int, int]]:
+        """
+        Returns up to `n` `(user_id, amount)` pairs, largest wallets first.
+        """
+        return [(-neg_id, -neg_amount) for neg_amount, neg_id in self._keys[:n]]
+
+
+leaderboard = Leaderboard(LEADERBOARD_CAPACITY)
+
+
+def _record_balance(user_id: int, amount: int):
+    """
+    Updates the in-memory views of a wallet after its new balance was committed.
+    """
+    balance_cache.put(user_id, amount)
+    leaderboard.update(user_id, amount)
+
+
+def queue_points_for_user(user_id: int, amount: int):
+    """
+    Buffer `amount` currency for chatter `user_id`.
+    The delta is merged with other buffered deltas and written by
+    `flush_pending_points`.
+    """
+    with _pending_lock:
+        _pending[user_id] = _pending.get(user_id, 0) + amount
+
+
+def _take_pending(user_ids: Iterable[int]) -> dict[int, int]:
+    with _pending_lock:
+        return {user_id: _pending.pop(user_id, 0) for user_id in user_ids}
+
+
+def _restore_pending(deltas: dict[int, int]):
+    with _pending_lock:
+        for user_id, delta in deltas.items():
+            _pending[user_id] = _pending.get(user_id, 0) + delta
+
+
+def _apply_deltas(
+    session: Session, deltas: dict[int, int], ledgered: int | dict[int, int] = 0
+) -> dict[int, int]:
+    """
+    Add each delta in `deltas` to the matching wallet, creating wallets as needed.
+    `ledgered` is the part of each delta that the caller records with a
+    `CurrencyTransaction`, either the same for every wallet or per wallet;
+    the rest is counted in the wallet's `accrued` total.
+    Runs as a single executemany upsert inside the caller's transaction.
+    Returns the new amount of each wallet.
+    """
+    stmt = sqlite_insert(CurrencyInfo)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CurrencyInfo.user_id],
+        set_={
+            "amount": CurrencyInfo.amount + stmt.excluded.amount,
+            "accrued": CurrencyInfo.accrued + stmt.excluded.accrued,
+        },
+    ).returning(CurrencyInfo.user_id, CurrencyInfo.amount)
+    rows = session.execute(
+        stmt,
+        [
+            {
+                "user_id": user_id,
+                "amount": delta,
+                "accrued": delta
+                - (ledgered if isinstance(ledgered, int) else ledgered[user_id]),
+            }
+            for user_id, delta in deltas.items()
+        ],
+    )
+    return {user_id: amount for user_id, amount in rows}
+
+
+def flush_pending_points() -> int:
+    """
+    Write all buffered deltas in one transaction.
+    Returns the number of wallets that were updated.
+    """
+    with _flush_lock:
+        with _pending_lock:
+            deltas = dict(_pending)
+            _pending.clear()
+        if not deltas:
             return 0
-        return info.amount
+        try:
+            with make_session() as session, session.begin():
+                new_amounts = _apply_deltas(session, deltas)
+        except Exception:
+            # put the deltas back so they are retried on the next flush;
+            # the cache is only updated after a successful commit
+            _restore_pending(deltas)
+            raise
+        for user_id, amount in new_amounts.items():
+            _record_balance(user_id, amount)
+        return len(deltas)
+
+
+def get_user_points(user_id: int) -> int:
+    """
+    Returns the amount of currency in chatter `id`'s wallet,
+    including accrued currency that has not been flushed yet.
+    """
+    with _flush_lock:
+        with _pending_lock:
+            pending = _pending.get(user_id, 0)
+        if (amount := balance_cache.get(user_id)) is None:
+            with make_session() as session:
+                info = session.get(CurrencyInfo, user_id)
+            amount = 0 if info is None else info.amount
+            balance_cache.put(user_id, amount)
+        return amount + pending
 
 
 def add_points_to_user(user_id: int, amount: int, reason: str | None = None) -> int:
     """
     Add `amount` currency to chatter `id`'s wallet.
+    Any buffered deltas for the chatter are written in the same transaction.
     Returns the new amount the user has.
     """
+    with _flush_lock:
+        pending = _take_pending([user_id])
+        try:
+            new_amount = _add_points(user_id, pending[user_id], amount, reason)
+        except Exception:
+            _restore_pending(pending)
+            raise
+        _record_balance(user_id, new_amount)
+        return new_amount
+
+
+def _add_points(user_id: int, pending: int, amount: int, reason: str | None) -> int:
     with make_session() as session, session.begin():
-        if session.get(CurrencyInfo, user_id) is None:
-            session.execute(insert(CurrencyInfo).values(user_id=user_id, amount=amount))
-            return amount
-        new_amount = session.scalar(
-            update(CurrencyInfo)
-            .where(CurrencyInfo.user_id == user_id)
-            .values(amount=CurrencyInfo.amount + amount)
-            .returning(CurrencyInfo.amount)
-        )
-        assert new_amount is not None
+        [new_amount] = _apply_deltas(
+            session,
+            {user_id: pending + amount},
+            ledgered=0 if reason is None else amount,
+        ).values()
 
         if reason is not None:
             session.add(
@@ -48,11 +267,204 @@ def add_points_to_user(user_id: int, amount: int, reason: str | None = None) ->
         return new_amount
 
 
-def get_currency_transactions(user_id: int, limit: int = 15):
+def _try_debit(
+    session: Session, user_id: int, amount: int, reason: str, pending: int = 0
+) -> int | None:
+    """
+    Take `amount` currency from chatter `user_id`'s wallet in a single
+    conditional UPDATE, unless the wallet plus `pending` holds less than that,
+    and record the debit in the ledger.
+    Runs inside the caller's transaction; the caller must hold `_flush_lock`,
+    have taken `pending` out of `_pending`, and record the new balance with
+    `_record_balance` once the transaction is committed.
+    Returns the new amount, or None if the wallet could not cover the debit.
+    """
+    new_amount = session.scalar(
+        update(CurrencyInfo)
+        .where(
+            CurrencyInfo.user_id == user_id,
+            CurrencyInfo.amount + pending >= amount,
+        )
+        .values(
+            amount=CurrencyInfo.amount + pending - amount,
+            accrued=CurrencyInfo.accrued + pending,
+        )
+        .returning(CurrencyInfo.amount)
+        .execution_options(synchronize_session=False)
+    )
+    if new_amount is None and pending >= amount:
+        # a chatter whose only currency is still buffered has no wallet row yet
+        new_amount = session.scalar(
+            sqlite_insert(CurrencyInfo)
+            .values(user_id=user_id, amount=pending - amount, accrued=pending)
+            .on_conflict_do_nothing()
+            .returning(CurrencyInfo.amount)
+        )
+    if new_amount is None:
+        return None
+    session.execute(
+        insert(CurrencyTransaction),
+        {
+            "user_id": user_id,
+            "time": datetime.now(),
+            "delta": -amount,
+            "end_amount": new_amount,
+            "reason": reason,
+        },
+    )
+    return new_amount
+
+
+def try_debit_user(user_id: int, amount: int, reason: str) -> int | None:
+    """
+    Take `amount` currency from chatter `user_id`'s wallet if it holds at least
+    that much, including buffered deltas.
+    Returns the new amount, or None if the wallet could not cover the debit.
+    """
+    with _flush_lock:
+        pending = _take_pending([user_id])
+        try:
+            with make_session() as session, session.begin():
+                new_amount = _try_debit(
+                    session, user_id, amount, reason, pending[user_id]
+                )
+        except Exception:
+            _restore_pending(pending)
+            raise
+        if new_amount is None:
+            _restore_pending(pending)
+            return None
+        _record_balance(user_id, new_amount)
+        return new_amount
+
+
+def add_points_to_users(
+    user_ids: Iterable[int], amount: int, reason: str
+) -> dict[int, int]:
+    """
+    Add `amount` currency to the wallet of every chatter in `user_ids`,
+    with a transaction for each, in a single database transaction.
+    Returns the new amount of each wallet.
+    """
+    with _flush_lock:
+        pending = _take_pending(set(user_ids))
+        if not pending:
+            return {}
+        try:
+            with make_session() as session, session.begin():
+                new_amounts = _apply_deltas(
+                    session,
+                    {user_id: delta + amount for user_id, delta in pending.items()},
+                    ledgered=amount,
+                )
+                now = datetime.now()
+                session.execute(
+                    insert(CurrencyTransaction),
+                    [
+                        {
+                            "user_id": user_id,
+                            "time": now,
+                            "delta": amount,
+                            "end_amount": new_amount,
+                            "reason": reason,
+                        }
+                        for user_id, new_amount in new_amounts.items()
+                    ],
+                )
+        except Exception:
+            _restore_pending(pending)
+            raise
+        for user_id, new_amount in new_amounts.items():
+            _record_balance(user_id, new_amount)
+        return new_amounts
+
+
+def _grant_points(
+    session: Session, amounts: dict[int, int], reason: str
+) -> dict[int, int]:
+    """
+    Add each amount in `amounts` to the matching wallet, with a transaction for
+    each, inside the caller's database transaction.
+    The caller must hold `_flush_lock` and pass the returned new amounts to
+    `_record_balance` once the transaction is committed.
+    """
+    if not amounts:
+        return {}
+    new_amounts = _apply_deltas(session, amounts, ledgered=amounts)
+    now = datetime.now()
+    session.execute(
+        insert(CurrencyTransaction),
+        [
+            {
+                "user_id": user_id,
+                "time": now,
+                "delta": amounts[user_id],
+                "end_amount": new_amount,
+                "reason": reason,
+            }
+            for user_id, new_amount in new_amounts.items()
+        ],
+    )
+    return new_amounts
+
+
+def get_currency_transactions(
+    user_id: int, limit: int = 15, before: tuple[datetime, int] | None = None
+):
+    """
+    Returns up to `limit` of chatter `user_id`'s transactions, newest first.
+    Pass the `(time, id)` of the last transaction of a page as `before`
+    to get the next page.
+    """
+    query = select(CurrencyTransaction).where(CurrencyTransaction.user_id == user_id)
+    if before is not None:
+        query = query.where(
+            tuple_(CurrencyTransaction.time, CurrencyTransaction.id) < tuple_(*before)
+        )
     with make_session() as session:
         return session.scalars(
-            select(CurrencyTransaction)
-            .where(CurrencyTransaction.user_id == user_id)
-            .order_by(CurrencyTransaction.time.desc())
-            .limit(limit)
+            query.order_by(
+                CurrencyTransaction.time.desc(), CurrencyTransaction.id.desc()
+            ).limit(limit)
         ).all()
+
+
+def _load_leaderboard(session: Session):
+    rows = session.execute(
+        select(CurrencyInfo.user_id, CurrencyInfo.amount)
+        .order_by(CurrencyInfo.amount.desc(), CurrencyInfo.user_id.desc())
+        .limit(leaderboard.capacity)
+    ).all()
+    leaderboard.seed([(user_id, amount) for user_id, amount in rows])
+
+
+def get_leaderboard(n: int = 10) -> list[tuple[int, int]]:
+    """
+    Returns up to `n` `(user_id, amount)` pairs for the largest wallets.
+    Accrued currency that has not been flushed yet is not counted.
+    """
+    assert n <= leaderboard.capacity
+    with _flush_lock:
+        if leaderboard.stale:
+            with make_session() as session:
+                _load_leaderboard(session)
+        return leaderboard.top(n)
+
+
+def get_rank(user_id: int) -> int | None:
+    """
+    Returns the 1-based leaderboard position of chatter `user_id`,
+    or None if they have no wallet.
+    Ties share a rank.
+    """
+    with _flush_lock, make_session() as session:
+        amount = session.scalar(
+            select(CurrencyInfo.amount).where(CurrencyInfo.user_id == user_id)
+        )
+        if amount is None:
+            return None
+        richer = session.scalar(
+            select(func.count()).where(CurrencyInfo.amount > amount)
+        )
+        assert richer is not None
+        return richer + 1
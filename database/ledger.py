@@ -0,0 +1,290 @@
+"""
+Maintenance of the currency transaction ledger.
+
+Reconciliation checks that every wallet holds its ledger sum plus the currency
+it accrued without transactions. Per-user ledger sums are checkpointed, so each
+run only reads the transactions added since the previous one.
+
+Compaction writes transactions older than a horizon to gzipped JSON-lines
+archives and replaces them in the database by one summary row per chatter per
+calendar month. A summary row takes the id and time of the newest transaction
+it replaces, so it sorts exactly where that transaction did in the history.
+Only reconciled transactions are compacted, so a summary never adds to a
+checkpointed ledger sum twice.
+"""
+
+import gzip
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from database import (
+    make_session,
+    CurrencyInfo,
+    CurrencyReconciliation,
+    CurrencyTransaction,
+)
+
+# held by every write to wallets and the ledger
+from database.currency import _flush_lock
+
+LOG = logging.getLogger(__name__)
+
+ARCHIVE_DIR = Path("sqlite-data/ledger-archive")
+
+
+@dataclass(frozen=True)
+class BalanceDivergence:
+    user_id: int
+    amount: int
+    expected: int
+
+
+def _reconciliation_checkpoint(session: Session) -> int:
+    """
+    Returns the id of the newest transaction included in the ledger sums.
+    """
+    checkpoint = session.scalar(
+        select(func.max(CurrencyReconciliation.last_transaction_id))
+    )
+    return checkpoint or 0
+
+
+def reconcile_balances() -> list[BalanceDivergence]:
+    """
+    Adds the transactions made since the last run to the checkpointed ledger sums
+    and checks the wallets of the chatters involved.
+    Returns the wallets that do not match their ledger.
+    """
+    with _flush_lock, make_session() as session, session.begin():
+        checkpoint = _reconciliation_checkpoint(session)
+        # summed here rather than with GROUP BY, which sqlite would serve by
+        # walking the whole user_id index instead of the primary key range
+        new_sums: dict[int, list[int]] = {}
+        for user_id, delta, transaction_id in session.execute(
+            select(
+                CurrencyTransaction.user_id,
+                CurrencyTransaction.delta,
+                CurrencyTransaction.id,
+            ).where(CurrencyTransaction.id > checkpoint)
+        ):
+            ledger_sum = new_sums.setdefault(user_id, [0, 0])
+            ledger_sum[0] += delta
+            ledger_sum[1] = max(ledger_sum[1], transaction_id)
+        if not new_sums:
+            return []
+
+        stmt = sqlite_insert(CurrencyReconciliation)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CurrencyReconciliation.user_id],
+            set_={
+                "ledger_sum": CurrencyReconciliation.ledger_sum
+                + stmt.excluded.ledger_sum,
+                "last_transaction_id": stmt.excluded.last_transaction_id,
+            },
+        )
+        session.execute(
+            stmt,
+            [
+                {
+                    "user_id": user_id,
+                    "ledger_sum": ledger_sum,
+                    "last_transaction_id": last_transaction_id,
+                }
+                for user_id, (ledger_sum, last_transaction_id) in new_sums.items()
+            ],
+        )
+
+        wallets = session.execute(
+            select(
+                CurrencyReconciliation.user_id,
+                func.coalesce(CurrencyInfo.amount, 0),
+                func.coalesce(CurrencyInfo.accrued, 0),
+                CurrencyReconciliation.ledger_sum,
+            )
+            .outerjoin(
+                CurrencyInfo, CurrencyInfo.user_id == CurrencyReconciliation.user_id
+            )
+            .where(CurrencyReconciliation.user_id.in_(new_sums))
+        ).all()
+
+    LOG.info(f"reconciled transactions of {len(new_sums)} wallets")
+    return [
+        BalanceDivergence(user_id, amount, ledger_sum + accrued)
+        for user_id, amount, accrued, ledger_sum in wallets
+        if amount != ledger_sum + accrued
+    ]
+
+
+@dataclass
+class _PeriodSummary:
+    id: int
+    user_id: int
+    period_start: datetime
+    time: datetime
+    delta: int
+    end_amount: int
+    archived_count: int
+
+    def as_row(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "time": self.time,
+            "delta": self.delta,
+            "end_amount": self.end_amount,
+            "reason": (
+                f"{self.archived_count} transactions from "
+                f"{self.period_start:%Y-%m-%d} to {self.time:%Y-%m-%d} (archived)"
+            ),
+            "archived_count": self.archived_count,
+            "period_start": self.period_start,
+        }
+
+
+def _start_of_month(time: datetime) -> datetime:
+    return time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month: datetime) -> datetime:
+    return _start_of_month(month + timedelta(days=32))
+
+
+def _oldest_compactable_month(
+    session: Session, cutoff: datetime, checkpoint: int
+) -> datetime | None:
+    oldest = session.scalar(
+        select(func.min(CurrencyTransaction.time)).where(
+            CurrencyTransaction.time < cutoff,
+            CurrencyTransaction.archived_count.is_(None),
+            CurrencyTransaction.id <= checkpoint,
+        )
+    )
+    return None if oldest is None else _start_of_month(oldest)
+
+
+def compact_ledger_month(
+    horizon: timedelta,
+    archive_dir: Path = ARCHIVE_DIR,
+    now: datetime | None = None,
+) -> int:
+    """
+    Archives the transactions of the oldest calendar month that ended more than
+    `horizon` ago and still has transactions, and replaces them with summary rows.
+    Returns the number of transactions that were archived, 0 once there are none.
+
+    Only the final delete and insert run in a write transaction; the archive is
+    written and synced before it starts.
+    """
+    cutoff = _start_of_month((now or datetime.now()) - horizon)
+    with make_session() as session:
+        checkpoint = _reconciliation_checkpoint(session)
+        month = _oldest_compactable_month(session, cutoff, checkpoint)
+        if month is None:
+            return 0
+        # nothing else writes transactions this old, and this runs on the single
+        # database thread, so the rows read here are the rows deleted below
+        is_compactable = (
+            CurrencyTransaction.time >= month,
+            CurrencyTransaction.time < _next_month(month),
+            CurrencyTransaction.archived_count.is_(None),
+            CurrencyTransaction.id <= checkpoint,
+        )
+        transactions = session.scalars(
+            select(CurrencyTransaction)
+            .where(*is_compactable)
+            .order_by(
+                CurrencyTransaction.user_id,
+                CurrencyTransaction.time,
+                CurrencyTransaction.id,
+            )
+            .execution_options(yield_per=1000)
+        )
+
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = archive_dir / f"currency_transactions-{month:%Y-%m}.jsonl.gz"
+        if archive_path.exists():
+            archive_path = archive_path.with_name(
+                f"currency_transactions-{month:%Y-%m}-{datetime.now():%Y%m%dT%H%M%S}.jsonl.gz"
+            )
+        partial_path = archive_path.with_suffix(".partial")
+        summaries: dict[int, _PeriodSummary] = {}
+        try:
+            with gzip.open(partial_path, "wt", encoding="utf-8") as archive:
+                for transaction in transactions:
+                    archive.write(
+                        json.dumps(
+                            {
+                                "id": transaction.id,
+                                "user_id": transaction.user_id,
+                                "time": transaction.time.isoformat(),
+                                "delta": transaction.delta,
+                                "end_amount": transaction.end_amount,
+                                "reason": transaction.reason,
+                            }
+                        )
+                        + "\n"
+                    )
+                    if (summary := summaries.get(transaction.user_id)) is None:
+                        summary = summaries[transaction.user_id] = _PeriodSummary(
+                            id=transaction.id,
+                            user_id=transaction.user_id,
+                            period_start=transaction.time,
+                            time=transaction.time,
+                            delta=0,
+                            end_amount=transaction.end_amount,
+                            archived_count=0,
+                        )
+                    summary.id = max(summary.id, transaction.id)
+                    summary.time = transaction.time
+                    summary.delta += transaction.delta
+                    summary.end_amount = transaction.end_amount
+                    summary.archived_count += 1
+            with open(partial_path, "rb") as archive:
+                os.fsync(archive.fileno())
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+
+    try:
+        with _flush_lock, make_session() as session, session.begin():
+            session.execute(delete(CurrencyTransaction).where(*is_compactable))
+            session.execute(
+                insert(CurrencyTransaction),
+                [summary.as_row() for summary in summaries.values()],
+            )
+            # the archive is in place before the rows are gone
+            os.replace(partial_path, archive_path)
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        archive_path.unlink(missing_ok=True)
+        raise
+
+    archived = sum(summary.archived_count for summary in summaries.values())
+    LOG.info(
+        f"archived {archived} currency transactions of {month:%Y-%m} "
+        f"into {len(summaries)} summaries at {archive_path}"
+    )
+    return archived
+
+
+def compact_ledger(
+    horizon: timedelta,
+    archive_dir: Path = ARCHIVE_DIR,
+    now: datetime | None = None,
+) -> int:
+    """
+    Compacts every month that ended more than `horizon` ago, one month per
+    transaction. Returns the number of transactions that were archived.
+    """
+    archived = 0
+    while month_archived := compact_ledger_month(horizon, archive_dir, now):
+        archived += month_archived
+    return archived
@@ -0,0 +1,167 @@
+"""
+Versioned schema migrations.
+
+The schema version is stored in sqlite's `PRAGMA user_version`.
+Version 1 is the schema that existed before migrations were introduced;
+databases from that time have tables but a `user_version` of 0.
+
+To change the schema, update the models in `database.models` and append a
+migration to `MIGRATIONS` that brings a database from the previous version up to
+the new one. Fresh databases are created directly from the models.
+"""
+
+import logging
+from typing import Callable
+
+from sqlalchemy import Connection, Engine, inspect
+
+from database.models import Base
+
+LOG = logging.getLogger(__name__)
+
+
+def _add_lookup_indexes(connection: Connection):
+    for statement in [
+        "CREATE INDEX IF NOT EXISTS ix_currency_transactions_user_id_time "
+        "ON currency_transactions (user_id, time)",
+        "CREATE INDEX IF NOT EXISTS ix_robomoji_transactions_chatter_id_time "
+        "ON robomoji_transactions (chatter_id, time)",
+        "CREATE INDEX IF NOT EXISTS ix_robomojis_user_id ON robomojis (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_prediction_votes_prediction_choice "
+        "ON prediction_votes (prediction, choice)",
+    ]:
+        connection.exec_driver_sql(statement)
+
+
+def _add_currency_amount_index(connection: Connection):
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_currency_amount ON currency (amount)"
+    )
+
+
+def _add_ledger_summary_columns(connection: Connection):
+    connection.exec_driver_sql(
+        "ALTER TABLE currency_transactions ADD COLUMN archived_count INTEGER"
+    )
+    connection.exec_driver_sql(
+        "ALTER TABLE currency_transactions ADD COLUMN period_start DATETIME"
+    )
+
+
+def _add_reconciliation(connection: Connection):
+    connection.exec_driver_sql(
+        "ALTER TABLE currency ADD COLUMN accrued INTEGER DEFAULT '0' NOT NULL"
+    )
+    # whatever the ledger does not explain was accrued from chatting
+    # or is the starting balance that used to go unrecorded
+    connection.exec_driver_sql(
+        "UPDATE currency SET accrued = amount - coalesce("
+        "(SELECT sum(delta) FROM currency_transactions AS t "
+        "WHERE t.user_id = currency.user_id), 0)"
+    )
+    connection.exec_driver_sql(
+        """CREATE TABLE currency_reconciliation (
+            user_id INTEGER NOT NULL,
+            ledger_sum INTEGER NOT NULL,
+            last_transaction_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id)
+        )"""
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX ix_currency_reconciliation_last_transaction_id "
+        "ON currency_reconciliation (last_transaction_id)"
+    )
+
+
+def _add_prediction_totals(connection: Connection):
+    for choice in ("a", "b"):
+        connection.exec_driver_sql(
+            f"ALTER TABLE predictions ADD COLUMN total_{choice} INTEGER "
+            "DEFAULT '0' NOT NULL"
+        )
+        connection.exec_driver_sql(
+            f"UPDATE predictions SET total_{choice} = coalesce("
+            "(SELECT sum(amount) FROM prediction_votes AS v "
+            "WHERE v.prediction = predictions.message_id "
+            f"AND v.choice = '{choice.upper()}'), 0)"
+        )
+
+
+def _consolidate_prediction_votes(connection: Connection):
+    # the oldest row of each voter and choice takes the sum of the others;
+    # every vote is still in the currency ledger
+    connection.exec_driver_sql(
+        "UPDATE prediction_votes SET amount = ("
+        "SELECT sum(v.amount) FROM prediction_votes AS v "
+        "WHERE v.prediction = prediction_votes.prediction "
+        "AND v.user_id = prediction_votes.user_id "
+        "AND v.choice = prediction_votes.choice) "
+        "WHERE id IN (SELECT min(id) FROM prediction_votes "
+        "GROUP BY prediction, user_id, choice HAVING count(*) > 1)"
+    )
+    connection.exec_driver_sql(
+        "DELETE FROM prediction_votes WHERE id NOT IN ("
+        "SELECT min(id) FROM prediction_votes GROUP BY prediction, user_id, choice)"
+    )
+    connection.exec_driver_sql(
+        "CREATE UNIQUE INDEX ux_prediction_votes_prediction_user_id_choice "
+        "ON prediction_votes (prediction, user_id, choice)"
+    )
+
+
+# MIGRATIONS[i] upgrades the schema from version i + 1 to version i + 2
+MIGRATIONS: list[Callable[[Connection], None]] = [
+    _add_lookup_indexes,
+    _add_currency_amount_index,
+    _add_ledger_summary_columns,
+    _add_reconciliation,
+    _add_prediction_totals,
+    _consolidate_prediction_votes,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS) + 1
+
+
+def get_schema_version(connection: Connection) -> int:
+    version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+    assert version is not None
+    return version
+
+
+def _set_schema_version(connection: Connection, version: int):
+    # pragmas cannot take bound parameters
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def run_migrations(engine: Engine) -> int:
+    """
+    Brings the database behind `engine` up to `SCHEMA_VERSION`.
+    Returns the schema version the database was at before migrating.
+    """
+    with engine.begin() as connection:
+        # pysqlite does not begin a transaction before DDL on its own, so without
+        # this a failed migration would leave earlier steps of the run committed
+        # while user_version still names the old version
+        connection.exec_driver_sql("BEGIN")
+        initial_version = version = get_schema_version(connection)
+        if version == 0:
+            if not inspect(connection).get_table_names():
+                LOG.info(f"creating database schema at version {SCHEMA_VERSION}")
+                Base.metadata.create_all(connection)
+                _set_schema_version(connection, SCHEMA_VERSION)
+                return initial_version
+            # tables created before migrations existed
+            version = 1
+
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"database schema version {version} is newer than "
+                f"the supported version {SCHEMA_VERSION}"
+            )
+
+        for migration in MIGRATIONS[version - 1 :]:
+            LOG.info(f"migrating database schema from version {version}")
+            migration(connection)
+            version += 1
+        _set_schema_version(connection, version)
+        return initial_version
@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 
-from sqlalchemy import CheckConstraint, ForeignKey
+from sqlalchemy import CheckConstraint, ForeignKey, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -24,11 +24,16 @@ class CurrencyInfo(Base):
     __tablename__ = "currency"
 
     user_id: Mapped[int] = mapped_column(primary_key=True)
-    amount: Mapped[int]
+    amount: Mapped[int] = mapped_column(index=True)
+    # currency added without a `CurrencyTransaction`, i.e. chat accruals
+    accrued: Mapped[int] = mapped_column(default=0, server_default="0")
 
 
 class CurrencyTransaction(Base):
     __tablename__ = "currency_transactions"
+    __table_args__ = (
+        Index("ix_currency_transactions_user_id_time", "user_id", "time"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int]
@@ -36,6 +41,21 @@ class CurrencyTransaction(Base):
     delta: Mapped[int]
     end_amount: Mapped[int]
     reason: Mapped[str]
+    # only set on rows that summarize archived transactions, see `database.ledger`
+    archived_count: Mapped[int | None]
+    period_start: Mapped[datetime | None]
+
+
+class CurrencyReconciliation(Base):
+    """
+    How much of a wallet's ledger has been verified, see `database.ledger`.
+    """
+
+    __tablename__ = "currency_reconciliation"
+
+    user_id: Mapped[int] = mapped_column(primary_key=True)
+    ledger_sum: Mapped[int]
+    last_transaction_id: Mapped[int] = mapped_column(index=True)
 
 
 #####    ROBOMOJI    #####
@@ -53,7 +73,9 @@ class Robomoji(Base):
     __tablename__ = "robomojis"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("robomoji_info.user_id"))
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("robomoji_info.user_id"), index=True
+    )
     emoji: Mapped[str]
 
 
@@ -69,6 +91,7 @@ class RobomojiTransaction(Base):
             "system != (staff_id IS NOT NULL)",  # interpret != as XOR
             "system_or_staff",
         ),
+        Index("ix_robomoji_transactions_chatter_id_time", "chatter_id", "time"),
     )
 
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -116,11 +139,25 @@ class Prediction(Base):
     choice_a: Mapped[str]
     choice_b: Mapped[str]
     winner: Mapped[PredictionChoice | None]
+    # running sums of the votes for each choice
+    total_a: Mapped[int] = mapped_column(default=0, server_default="0")
+    total_b: Mapped[int] = mapped_column(default=0, server_default="0")
     votes: Mapped[list["PredictionVote"]] = relationship()
 
 
 class PredictionVote(Base):
     __tablename__ = "prediction_votes"
+    __table_args__ = (
+        Index("ix_prediction_votes_prediction_choice", "prediction", "choice"),
+        # one row per voter and choice; repeated votes add to its amount
+        Index(
+            "ux_prediction_votes_prediction_user_id_choice",
+            "prediction",
+            "user_id",
+            "choice",
+            unique=True,
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     prediction: Mapped[int] = mapped_column(ForeignKey("predictions.message_id"))
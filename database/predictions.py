@@ -1,8 +1,9 @@
 import logging
 from collections import defaultdict
-from math import ceil
+from dataclasses import dataclass, replace
 
 from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session, joinedload
 
 from database import (
@@ -12,11 +13,82 @@ from database import (
     PredictionStatus,
     PredictionChoice,
 )
-from database.currency import add_points_to_user, get_user_points
+from database.currency import (
+    _flush_lock,
+    _grant_points,
+    _record_balance,
+    _restore_pending,
+    _take_pending,
+    _try_debit,
+)
 
 LOG = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class LivePrediction:
+    message_id: int
+    title: str
+    choice_a: str
+    choice_b: str
+    status: PredictionStatus = PredictionStatus.OPEN
+    votes_a: int = 0
+    votes_b: int = 0
+
+
+# Every open or closed prediction with its vote totals, loaded by
+# `load_live_predictions` and kept up to date by the writes in this module.
+# Paid and refunded predictions are dropped. `LivePrediction` is frozen, and a
+# reload rebinds the dict, so readers never see a partial state.
+_live_predictions: dict[int, LivePrediction] = {}
+
+
+def load_live_predictions():
+    """
+    Loads every open or closed prediction and its vote totals in one query.
+    """
+    global _live_predictions
+    with make_session() as session:
+        predictions = {
+            prediction.message_id: LivePrediction(
+                prediction.message_id,
+                prediction.title,
+                prediction.choice_a,
+                prediction.choice_b,
+                status=prediction.status,
+                votes_a=prediction.total_a,
+                votes_b=prediction.total_b,
+            )
+            for prediction in session.scalars(
+                select(Prediction).where(
+                    Prediction.status.in_(
+                        [PredictionStatus.OPEN, PredictionStatus.CLOSED]
+                    )
+                )
+            )
+        }
+    _live_predictions = predictions
+    LOG.info(f"loaded {len(predictions)} open or closed predictions")
+
+
+def get_live_prediction(message_id: int) -> LivePrediction | None:
+    """
+    Returns the prediction attached to `message_id` without touching the
+    database, or None if there is no such prediction or it was settled.
+    """
+    return _live_predictions.get(message_id)
+
+
+def get_open_prediction(message_id: int) -> LivePrediction | None:
+    """
+    Like `get_live_prediction`, but only returns open predictions.
+    """
+    prediction = _live_predictions.get(message_id)
+    if prediction is None or prediction.status != PredictionStatus.OPEN:
+        return None
+    return prediction
+
+
 def create_prediction(message_id: int, title: str, choice_a: str, choice_b: str):
     with make_session() as session, session.begin():
         session.add(
@@ -29,6 +101,9 @@ def create_prediction(message_id: int, title: str, choice_a: str, choice_b: str)
                 winner=None,
             )
         )
+    _live_predictions[message_id] = LivePrediction(
+        message_id, title, choice_a, choice_b
+    )
 
 
 def get_prediction(message_id: int) -> Prediction | None:
@@ -40,21 +115,45 @@ def get_prediction(message_id: int) -> Prediction | None:
         )
 
 
-def get_votes_summary(message_id: int, session: Session):
-    votes = session.execute(
-        select(PredictionVote.choice, func.sum(PredictionVote.amount))
-        .where(PredictionVote.prediction == message_id)
-        .group_by(PredictionVote.choice)
-    ).all()
-
-    d: dict[PredictionChoice, int] = defaultdict(int)
-    for choice, total_amount in votes:
-        d[choice] = total_amount
-    return d
+def get_votes_summary(prediction: Prediction) -> dict[PredictionChoice, int]:
+    return {
+        PredictionChoice.A: prediction.total_a,
+        PredictionChoice.B: prediction.total_b,
+    }
 
 
 def add_prediction_vote(
     message_id: int, user_id: int, choice: PredictionChoice, amount: int
+):
+    """
+    Debits the vote from the chatter's wallet, records it and updates the
+    prediction's totals in one transaction.
+    Returns the new totals, or why the vote was rejected.
+    """
+    with _flush_lock:
+        pending = _take_pending([user_id])
+        try:
+            result = _add_vote(message_id, user_id, choice, amount, pending[user_id])
+        except Exception:
+            _restore_pending(pending)
+            raise
+        if isinstance(result, str):
+            _restore_pending(pending)
+            return result
+        new_amount, summary = result
+        _record_balance(user_id, new_amount)
+
+    if (cached := _live_predictions.get(message_id)) is not None:
+        _live_predictions[message_id] = replace(
+            cached,
+            votes_a=summary[PredictionChoice.A],
+            votes_b=summary[PredictionChoice.B],
+        )
+    return summary
+
+
+def _add_vote(
+    message_id: int, user_id: int, choice: PredictionChoice, amount: int, pending: int
 ):
     with make_session() as session, session.begin():
         prediction = session.get(Prediction, message_id)
@@ -66,23 +165,35 @@ def add_prediction_vote(
         if prediction.status != PredictionStatus.OPEN:
             return "prediction is not open"
 
-        if get_user_points(user_id) < amount:
-            return "not enough points"
-
         choice_label = (
             prediction.choice_a if choice == PredictionChoice.A else prediction.choice_b
         )
         reason = f"voted for {choice} ({choice_label}) in prediction {message_id}"
-        add_points_to_user(user_id, -amount, reason)
+        new_amount = _try_debit(session, user_id, amount, reason, pending)
+        if new_amount is None:
+            return "not enough points"
 
-        vote = PredictionVote(
-            prediction=message_id,
-            user_id=user_id,
-            amount=amount,
-            choice=choice,
+        # the ledger keeps each vote; the table keeps one row per voter and choice
+        stmt = sqlite_insert(PredictionVote).values(
+            prediction=message_id, user_id=user_id, amount=amount, choice=choice
+        )
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[
+                    PredictionVote.prediction,
+                    PredictionVote.user_id,
+                    PredictionVote.choice,
+                ],
+                set_={"amount": PredictionVote.amount + stmt.excluded.amount},
+            )
         )
-        prediction.votes.append(vote)
-        return get_votes_summary(message_id, session)
+        # incremented in SQL so the totals can never miss a concurrent vote
+        if choice == PredictionChoice.A:
+            prediction.total_a = Prediction.total_a + amount
+        else:
+            prediction.total_b = Prediction.total_b + amount
+        session.flush()
+        return new_amount, get_votes_summary(prediction)
 
 
 def close_prediction(message_id: int):
@@ -95,70 +206,149 @@ def close_prediction(message_id: int):
         if prediction.status == PredictionStatus.PAID:
             return "prediction has already been paid"
         prediction.status = PredictionStatus.CLOSED
-        return get_votes_summary(message_id, session)
+        summary = get_votes_summary(prediction)
+    if (cached := _live_predictions.get(message_id)) is not None:
+        _live_predictions[message_id] = replace(
+            cached,
+            status=PredictionStatus.CLOSED,
+            votes_a=summary[PredictionChoice.A],
+            votes_b=summary[PredictionChoice.B],
+        )
+    return summary
 
 
-def pay_out_prediction(message_id: int, winner: PredictionChoice):
-    with make_session() as session, session.begin():
-        prediction = session.get(Prediction, message_id)
-        if prediction is None:
-            raise ValueError(f"could not find prediction attached to {message_id=}")
-        if prediction.status == PredictionStatus.PAID:
-            return "prediction has already been paid out"
-        if prediction.status != PredictionStatus.CLOSED:
-            raise ValueError(f"prediction attached to {message_id=} is not closed")
+def _stakes(
+    session: Session, message_id: int, choice: PredictionChoice | None = None
+) -> dict[int, int]:
+    """
+    Returns the total amount each chatter put on `choice`, or on either choice.
+    """
+    query = select(PredictionVote.user_id, PredictionVote.amount).where(
+        PredictionVote.prediction == message_id
+    )
+    if choice is not None:
+        query = query.where(PredictionVote.choice == choice)
+    stakes: dict[int, int] = defaultdict(int)
+    for user_id, amount in session.execute(query):
+        stakes[user_id] += amount
+    return stakes
 
-        votes = session.scalars(
-            select(PredictionVote).where(PredictionVote.prediction == message_id)
-        ).all()
 
-        a_vote_amount = sum(
-            vote.amount for vote in votes if vote.choice == PredictionChoice.A
-        )
-        b_vote_amount = sum(
-            vote.amount for vote in votes if vote.choice == PredictionChoice.B
-        )
-        total_amount = a_vote_amount + b_vote_amount
-        correct_vote_amount = (
-            a_vote_amount if winner == PredictionChoice.A else b_vote_amount
-        )
+def _get_prediction_or_raise(session: Session, message_id: int) -> Prediction:
+    prediction = session.get(Prediction, message_id)
+    if prediction is None:
+        raise ValueError(f"could not find prediction attached to {message_id=}")
+    return prediction
+
 
-        if correct_vote_amount == 0:
-            d = refund_prediction(message_id)
-            assert d != "prediction has already been paid out"
-            return "prediction has no winners", d
-
-        for vote in votes:
-            if vote.choice != winner:
-                continue
-            reward = ceil(total_amount * vote.amount / correct_vote_amount)
-            print("adding", vote.user_id, reward)
-            add_points_to_user(
-                vote.user_id, reward, reason=f"prediction {message_id} payout"
+def pay_out_prediction(message_id: int, winner: PredictionChoice):
+    """
+    Pays every winning chatter their share of the whole pot, rounded up,
+    in one transaction. Refunds everyone if nobody picked the winner.
+    """
+    with _flush_lock:
+        with make_session() as session, session.begin():
+            prediction = _get_prediction_or_raise(session, message_id)
+            if prediction.status == PredictionStatus.PAID:
+                return "prediction has already been paid out"
+            if prediction.status != PredictionStatus.CLOSED:
+                raise ValueError(f"prediction attached to {message_id=} is not closed")
+
+            total_amount = prediction.total_a + prediction.total_b
+            correct_vote_amount = (
+                prediction.total_a
+                if winner == PredictionChoice.A
+                else prediction.total_b
             )
+            if correct_vote_amount == 0:
+                new_amounts = _refund(session, prediction)
+                result = "prediction has no winners", get_votes_summary(prediction)
+            else:
+                rewards = {
+                    # ceil(total_amount * stake / correct_vote_amount) in integers
+                    user_id: -(-total_amount * stake // correct_vote_amount)
+                    for user_id, stake in _stakes(session, message_id, winner).items()
+                }
+                new_amounts = _grant_points(
+                    session, rewards, reason=f"prediction {message_id} payout"
+                )
+                prediction.status = PredictionStatus.PAID
+                prediction.winner = winner
+                result = get_votes_summary(prediction)
+
+        for user_id, new_amount in new_amounts.items():
+            _record_balance(user_id, new_amount)
+    _live_predictions.pop(message_id, None)
+    return result
 
-        prediction.status = PredictionStatus.PAID
-        prediction.winner = winner
-        return get_votes_summary(message_id, session)
+
+def _refund(session: Session, prediction: Prediction) -> dict[int, int]:
+    new_amounts = _grant_points(
+        session,
+        _stakes(session, prediction.message_id),
+        reason=f"prediction {prediction.message_id} refund",
+    )
+    prediction.status = PredictionStatus.REFUNDED
+    return new_amounts
 
 
 def refund_prediction(message_id: int):
-    with make_session() as session, session.begin():
-        prediction = session.get(Prediction, message_id)
-        if prediction is None:
-            raise ValueError(f"could not find prediction attached to {message_id=}")
-        if prediction.status == PredictionStatus.PAID:
-            return "prediction has already been paid out"
-        if prediction.status != PredictionStatus.CLOSED:
-            raise ValueError(f"prediction attached to {message_id=} is not closed")
+    """
+    Gives every chatter back what they put on the prediction, in one transaction.
+    """
+    with _flush_lock:
+        with make_session() as session, session.begin():
+            prediction = _get_prediction_or_raise(session, message_id)
+            if prediction.status == PredictionStatus.PAID:
+                return "prediction has already been paid out"
+            if prediction.status != PredictionStatus.CLOSED:
+                raise ValueError(f"prediction attached to {message_id=} is not closed")
 
-        votes = session.scalars(
-            select(PredictionVote).where(PredictionVote.prediction == message_id)
-        ).all()
+            new_amounts = _refund(session, prediction)
+            result = get_votes_summary(prediction)
 
-        for vote in votes:
-            add_points_to_user(
-                vote.user_id, vote.amount, reason=f"prediction {message_id} refund"
+        for user_id, new_amount in new_amounts.items():
+            _record_balance(user_id, new_amount)
+    _live_predictions.pop(message_id, None)
+    return result
+
+
+@dataclass(frozen=True)
+class TotalsDivergence:
+    message_id: int
+    choice: PredictionChoice
+    total: int
+    expected: int
+
+
+def check_prediction_totals() -> list[TotalsDivergence]:
+    """
+    Compares the stored vote totals of every prediction with the sum of its votes.
+    Returns the totals that do not match.
+    """
+    with make_session() as session:
+        sums = {
+            (prediction, choice): total
+            for prediction, choice, total in session.execute(
+                select(
+                    PredictionVote.prediction,
+                    PredictionVote.choice,
+                    func.sum(PredictionVote.amount),
+                ).group_by(PredictionVote.prediction, PredictionVote.choice)
             )
-        prediction.status = PredictionStatus.REFUNDED
-        return get_votes_summary(message_id, session)
+        }
+        predictions = session.execute(
+            select(Prediction.message_id, Prediction.total_a, Prediction.total_b)
+        ).all()
+    divergences = []
+    for message_id, total_a, total_b in predictions:
+        for choice, total in (
+            (PredictionChoice.A, total_a),
+            (PredictionChoice.B, total_b),
+        ):
+            expected = sums.get((message_id, choice), 0)
+            if total != expected:
+                divergences.append(
+                    TotalsDivergence(message_id, choice, total, expected)
+                )
+    return divergences
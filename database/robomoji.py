@@ -1,8 +1,11 @@
 import logging
-from datetime import datetime
-from typing import Literal, Sequence
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable, Literal, Sequence
 
-from sqlalchemy import select
+from sqlalchemy import select, tuple_, update
 
 from database import make_session, RobomojiInfo, Robomoji, RobomojiTransaction
 from database.models import RobomojiTransactionKind
@@ -10,13 +13,132 @@ from database.models import RobomojiTransactionKind
 LOG = logging.getLogger(__name__)
 
 
-def get_emoji_changes(user_id: int, limit=15) -> Sequence[RobomojiTransaction]:
+@dataclass
+class CachedRobomojis:
+    emojis: tuple[str, ...]
+    # `time.monotonic()` of the last reaction
+    last_reacted: float
+
+
+# Robomojis of every chatter who has at least one, loaded by `load_emoji_index`
+# and kept up to date by the writes in this module. The event loop reads it
+# while the database thread writes, so published entries are never mutated:
+# writes store a new entry and loads swap in a whole new dict.
+_index: dict[int, CachedRobomojis] = {}
+
+# Wall-clock times of reactions that `flush_emoji_uses` has not written yet.
+# `_uses_lock` guards both this dict and replacing entries of `_index`.
+_unflushed_uses: dict[int, datetime] = {}
+_uses_lock = threading.Lock()
+
+
+def _to_monotonic(when: datetime) -> float:
+    return time.monotonic() - (datetime.now() - when).total_seconds()
+
+
+def load_emoji_index():
+    """
+    Loads the robomojis of every chatter in one query.
+    """
+    global _index
+    emojis: dict[int, list[str]] = {}
+    last_reacted: dict[int, float] = {}
+    with make_session() as session:
+        rows = session.execute(
+            select(Robomoji.user_id, Robomoji.emoji, RobomojiInfo.last_reacted)
+            .join(RobomojiInfo, Robomoji.user_id == RobomojiInfo.user_id)
+            .order_by(Robomoji.id)
+        )
+        for user_id, emoji, reacted in rows:
+            emojis.setdefault(user_id, []).append(emoji)
+            last_reacted[user_id] = _to_monotonic(reacted)
+    with _uses_lock:
+        # uses that are not in the database yet are newer than what was loaded
+        for user_id in _unflushed_uses.keys() & emojis.keys():
+            last_reacted[user_id] = _index[user_id].last_reacted
+        _index = {
+            user_id: CachedRobomojis(tuple(user_emojis), last_reacted[user_id])
+            for user_id, user_emojis in emojis.items()
+        }
+    LOG.info(f"loaded robomojis of {len(emojis)} chatters")
+
+
+def get_cached_emojis(user_id: int) -> CachedRobomojis | None:
+    """
+    Returns chatter `user_id`'s robomojis without touching the database,
+    or None if they have none.
+    """
+    return _index.get(user_id)
+
+
+def get_all_cached_emojis() -> set[str]:
+    """
+    Returns every emoji that is some chatter's robomoji.
+    """
+    return {emoji for entry in list(_index.values()) for emoji in entry.emojis}
+
+
+def use_emojis(user_id: int, cooldown: timedelta) -> tuple[str, ...]:
+    """
+    Returns the robomojis chatter `user_id` should be reacted with, or an empty
+    tuple if they have none or reacted less than `cooldown` ago.
+    The reaction is recorded in memory and persisted by `flush_emoji_uses`.
+    """
+    now = time.monotonic()
+    with _uses_lock:
+        entry = _index.get(user_id)
+        if entry is None or now - entry.last_reacted < cooldown.total_seconds():
+            return ()
+        _index[user_id] = CachedRobomojis(entry.emojis, now)
+        _unflushed_uses[user_id] = datetime.now()
+    return entry.emojis
+
+
+def flush_emoji_uses() -> int:
+    """
+    Writes the reaction times recorded by `use_emojis` in one transaction.
+    Returns the number of chatters that were updated.
+    """
+    with _uses_lock:
+        uses = dict(_unflushed_uses)
+        _unflushed_uses.clear()
+    if not uses:
+        return 0
+    try:
+        with make_session() as session, session.begin():
+            session.execute(
+                update(RobomojiInfo),
+                [
+                    {"user_id": user_id, "last_reacted": last_reacted}
+                    for user_id, last_reacted in uses.items()
+                ],
+            )
+    except Exception:
+        with _uses_lock:
+            for user_id, last_reacted in uses.items():
+                _unflushed_uses.setdefault(user_id, last_reacted)
+        raise
+    return len(uses)
+
+
+def get_emoji_changes(
+    user_id: int, limit=15, before: tuple[datetime, int] | None = None
+) -> Sequence[RobomojiTransaction]:
+    """
+    Returns up to `limit` of chatter `user_id`'s robomoji changes, newest first.
+    Pass the `(time, id)` of the last change of a page as `before`
+    to get the next page.
+    """
+    query = select(RobomojiTransaction).where(RobomojiTransaction.chatter_id == user_id)
+    if before is not None:
+        query = query.where(
+            tuple_(RobomojiTransaction.time, RobomojiTransaction.id) < tuple_(*before)
+        )
     with make_session() as session:
         return session.scalars(
-            select(RobomojiTransaction)
-            .where(RobomojiTransaction.chatter_id == user_id)
-            .order_by(RobomojiTransaction.time)
-            .limit(limit)
+            query.order_by(
+                RobomojiTransaction.time.desc(), RobomojiTransaction.id.desc()
+            ).limit(limit)
         ).all()
 
 
@@ -27,15 +149,6 @@ def get_emoji_info(user_id: int) -> RobomojiInfo | None:
         )
 
 
-def register_emoji_use(user_id: int):
-    with make_session() as session, session.begin():
-        info = session.get(RobomojiInfo, user_id)
-        if info is None:
-            session.add(RobomojiInfo(user_id=user_id, last_reacted=datetime.now()))
-            return
-        info.last_reacted = datetime.now()
-
-
 def toggle_emoji(
     staff_id: int | Literal["SYSTEM"],
     user_id: int,
@@ -48,16 +161,20 @@ def toggle_emoji(
             info = RobomojiInfo(user_id=user_id, last_reacted=datetime.min)
             session.add(info)
         robomojis = [] if info is None else info.robomojis
+        emojis = tuple(robomoji.emoji for robomoji in robomojis)
+        last_reacted = _to_monotonic(info.last_reacted)
 
         for robomoji in robomojis:
             if robomoji.emoji == emoji:
                 session.delete(robomoji)
                 operation = RobomojiTransactionKind.REMOVED
+                emojis = tuple(e for e in emojis if e != emoji)
                 break
         else:
             new_robomoji = Robomoji(user_id=info.user_id, emoji=emoji)
             session.add(new_robomoji)
             operation = RobomojiTransactionKind.ADDED
+            emojis += (emoji,)
 
         is_system = staff_id == "SYSTEM"
         session.add(
@@ -72,4 +189,95 @@ def toggle_emoji(
             )
         )
 
+    with _uses_lock:
+        if (entry := _index.get(user_id)) is not None:
+            # the reaction time in the database may not have been flushed yet
+            last_reacted = entry.last_reacted
+        if emojis:
+            _index[user_id] = CachedRobomojis(emojis, last_reacted)
+        else:
+            _index.pop(user_id, None)
     return operation
+
+
+def remove_missing_emojis(
+    user_id: int, emojis: Iterable[str], reason: str
+) -> list[str]:
+    """
+    Removes `emojis` from chatter `user_id`'s robomojis in one transaction,
+    recording a system transaction for each.
+    Returns the emojis that were removed.
+    """
+    missing = set(emojis)
+    with make_session() as session, session.begin():
+        info = session.get(RobomojiInfo, user_id)
+        if info is None:
+            return []
+        removed = []
+        now = datetime.now()
+        for robomoji in info.robomojis:
+            if robomoji.emoji not in missing:
+                continue
+            session.delete(robomoji)
+            removed.append(robomoji.emoji)
+            session.add(
+                RobomojiTransaction(
+                    chatter_id=user_id,
+                    emoji=robomoji.emoji,
+                    time=now,
+                    system=True,
+                    staff_id=None,
+                    reason=reason,
+                    action=RobomojiTransactionKind.REMOVED,
+                )
+            )
+
+    with _uses_lock:
+        if (entry := _index.get(user_id)) is not None:
+            emojis = tuple(emoji for emoji in entry.emojis if emoji not in missing)
+            if emojis:
+                _index[user_id] = CachedRobomojis(emojis, entry.last_reacted)
+            else:
+                _index.pop(user_id, None)
+    return removed
+
+
+def remove_emojis_everywhere(
+    emojis: Iterable[str], reason: str
+) -> dict[int, list[str]]:
+    """
+    Removes `emojis` from every chatter's robomojis in one transaction,
+    recording a system transaction for each.
+    Returns the removed emojis of each chatter.
+    """
+    removed: dict[int, list[str]] = {}
+    with make_session() as session, session.begin():
+        robomojis = session.scalars(
+            select(Robomoji).where(Robomoji.emoji.in_(set(emojis)))
+        ).all()
+        now = datetime.now()
+        for robomoji in robomojis:
+            session.delete(robomoji)
+            removed.setdefault(robomoji.user_id, []).append(robomoji.emoji)
+            session.add(
+                RobomojiTransaction(
+                    chatter_id=robomoji.user_id,
+                    emoji=robomoji.emoji,
+                    time=now,
+                    system=True,
+                    staff_id=None,
+                    reason=reason,
+                    action=RobomojiTransactionKind.REMOVED,
+                )
+            )
+
+    with _uses_lock:
+        for user_id, user_removed in removed.items():
+            if (entry := _index.get(user_id)) is None:
+                continue
+            kept = tuple(emoji for emoji in entry.emojis if emoji not in user_removed)
+            if kept:
+                _index[user_id] = CachedRobomojis(kept, entry.last_reacted)
+            else:
+                _index.pop(user_id, None)
+    return removed
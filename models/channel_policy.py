@@ -0,0 +1,61 @@
+import logging
+from typing import TYPE_CHECKING, Iterable
+
+from discord import (
+    ForumChannel,
+    StageChannel,
+    TextChannel,
+    Thread,
+    VoiceChannel,
+)
+
+if TYPE_CHECKING:
+    from discord.abc import MessageableChannel
+
+LOG = logging.getLogger(__name__)
+
+
+class ChannelPolicy:
+    """
+    Decides which channels a message listener acts in, given channels and
+    categories it is excluded from. Messages in threads follow the thread's
+    parent channel.
+
+    Verdicts are memoized per channel id, so checking a message is one dict
+    lookup. A channel moving between categories changes the verdict of the
+    channel and its threads, so `invalidate` must be called whenever channels
+    are created, updated or deleted.
+    """
+
+    def __init__(
+        self, excluded_channels: Iterable[int], excluded_categories: Iterable[int]
+    ):
+        self.excluded_channels = frozenset(excluded_channels)
+        self.excluded_categories = frozenset(excluded_categories)
+        self._verdicts: dict[int, bool] = {}
+
+    def allows(self, channel: "MessageableChannel") -> bool:
+        if (verdict := self._verdicts.get(channel.id)) is None:
+            if isinstance(channel, Thread) and channel.parent is None:
+                # not memoized, the parent may be cached by the next message
+                LOG.debug(f"parent of {channel=} is not cached")
+                return False
+            verdict = self._verdicts[channel.id] = self._decide(channel)
+        return verdict
+
+    def _decide(self, channel: "MessageableChannel") -> bool:
+        if isinstance(channel, Thread):
+            channel = channel.parent
+
+        match channel:
+            case TextChannel() | StageChannel() | VoiceChannel() | ForumChannel():
+                return (
+                    channel.id not in self.excluded_channels
+                    and channel.category_id not in self.excluded_categories
+                )
+            case _:
+                LOG.debug(f"no exclusions apply to {channel=}")
+                return True
+
+    def invalidate(self):
+        self._verdicts.clear()
@@ -0,0 +1,113 @@
+import time
+from collections import defaultdict
+from typing import Callable, Literal
+
+# all times are in seconds from `time.monotonic`
+ACCRUAL_COOLDOWN = 10 * 60.0
+ACCUMULATION_DELAY = 10 * 60.0
+# an entry whose window is older than this can be forgotten
+COOLDOWN_LIFETIME = ACCRUAL_COOLDOWN + ACCUMULATION_DELAY
+# width of one slot of the expiry wheel
+EXPIRY_GRANULARITY = 60.0
+
+
+class CurrencyCooldown:
+    """
+    based off of discord.py's Cooldown class
+    """
+
+    __slots__ = ("window", "in_stream")
+
+    def __init__(self, window: float, in_stream: bool = False):
+        self.window = window
+        self.in_stream = in_stream
+
+    def __repr__(self) -> str:
+        return f"CurrencyCooldown(window={self.window}, in_stream={self.in_stream})"
+
+    def _try_use(self, now: float) -> bool:
+        """
+        returns whether cooldown was used and updated
+        """
+        if self.window + ACCRUAL_COOLDOWN < now:
+            if now < self.window + COOLDOWN_LIFETIME:
+                self.window += ACCRUAL_COOLDOWN
+            else:
+                self.window = now
+            return True
+        return False
+
+    def try_use_normal(self, now: float) -> bool:
+        """
+        returns whether cooldown was used and updated
+        """
+        if self._try_use(now):
+            self.in_stream = False
+            return True
+        return False
+
+    def try_use_stream(self, now: float) -> Literal["blocked", "promoted", "accepted"]:
+        if self._try_use(now):
+            self.in_stream = True
+            return "accepted"
+        elif not self.in_stream:
+            self.in_stream = True
+            return "promoted"
+        return "blocked"
+
+
+class CurrencyCooldownMap:
+    """
+    Cooldowns by user id, with a timing wheel of expiry times so that forgetting
+    old entries costs amortized O(1) per message instead of a scan of the map.
+
+    A user is filed in the slot of their entry's expiry every time its window
+    moves, so slots can hold stale ids; those are skipped when the slot is swept.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self.map: dict[int, CurrencyCooldown] = {}
+        self._wheel: defaultdict[int, list[int]] = defaultdict(list)
+        self._next_slot = int(clock() // EXPIRY_GRANULARITY)
+
+    def _schedule(self, user_id: int, cooldown: CurrencyCooldown):
+        expiry = cooldown.window + COOLDOWN_LIFETIME
+        self._wheel[int(expiry // EXPIRY_GRANULARITY) + 1].append(user_id)
+
+    def _clean_cache(self, now: float | None = None):
+        if now is None:
+            now = self.clock()
+        current_slot = int(now // EXPIRY_GRANULARITY)
+        while self._next_slot <= current_slot:
+            for user_id in self._wheel.pop(self._next_slot, ()):
+                cooldown = self.map.get(user_id)
+                if cooldown is not None and cooldown.window + COOLDOWN_LIFETIME < now:
+                    del self.map[user_id]
+            self._next_slot += 1
+
+    def try_use_normal(self, user_id: int) -> bool:
+        now = self.clock()
+        self._clean_cache(now)
+        if (cooldown := self.map.get(user_id)) is None:
+            cooldown = self.map[user_id] = CurrencyCooldown(now)
+            self._schedule(user_id, cooldown)
+            return True
+        if cooldown.try_use_normal(now):
+            self._schedule(user_id, cooldown)
+            return True
+        return False
+
+    def try_use_stream(
+        self, user_id: int
+    ) -> Literal["blocked", "promoted", "accepted"]:
+        now = self.clock()
+        self._clean_cache(now)
+        if (cooldown := self.map.get(user_id)) is None:
+            cooldown = self.map[user_id] = CurrencyCooldown(now, in_stream=True)
+            self._schedule(user_id, cooldown)
+            return "accepted"
+        result = cooldown.try_use_stream(now)
+        if result == "accepted":
+            self._schedule(user_id, cooldown)
+        return result
@@ -37,6 +37,20 @@ class PredictionInfo:
             winner=prediction.winner,
         )
 
+    @classmethod
+    def from_live(
+        cls, prediction: db.LivePrediction, prediction_message: Message
+    ) -> Self:
+        return cls(
+            message=prediction_message,
+            title=prediction.title,
+            choice_a=prediction.choice_a,
+            choice_b=prediction.choice_b,
+            status=prediction.status,
+            votes_a=prediction.votes_a,
+            votes_b=prediction.votes_b,
+        )
+
     def make_embed(self, base_embed: Embed | None = None) -> Embed:
         def make_label(votes: int, winner: bool = False) -> str:
             return f"{_pluralize(votes, 'point')}" + (" (WINNER)" if winner else "")
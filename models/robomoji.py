@@ -1,6 +1,13 @@
+import asyncio
 import datetime
+import logging
+import unicodedata
 from dataclasses import dataclass
-from typing import Literal
+from typing import Awaitable, Callable, Literal, Sequence
+
+from discord import Emoji, HTTPException, Message, PartialEmoji
+
+LOG = logging.getLogger(__name__)
 
 
 @dataclass
@@ -11,3 +18,139 @@ class RobomojiTransaction:
     action: Literal["added", "removed"]
     emoji: str
     reason: str
+
+
+def _is_missing_emoji(error: HTTPException) -> bool:
+    """
+    Whether Discord rejected a reaction because the emoji does not exist.
+    """
+    return error.code == 10014 or (error.code == 50035 and "emoji_id" in error.text)
+
+
+class ReactionDispatcher:
+    """
+    Adds reactions from background tasks so that listeners never wait on them.
+
+    The reactions to a message are sent concurrently, but at most
+    `per_channel` at a time in each channel: Discord rate limits reactions per
+    channel, and requests beyond the bucket would only queue up in the HTTP
+    client. Emojis that Discord does not know are collected and handed to
+    `on_missing(message, emojis)` once all reactions to the message are done.
+    """
+
+    def __init__(
+        self,
+        on_missing: Callable[[Message, list[str]], Awaitable[None]],
+        per_channel: int = 4,
+    ):
+        self.on_missing = on_missing
+        self.per_channel = per_channel
+        self._channel_slots: dict[int, asyncio.Semaphore] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def dispatch(self, message: Message, emojis: Sequence[str]):
+        if not emojis:
+            return
+        task = asyncio.create_task(self._react(message, emojis))
+        # the event loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _react(self, message: Message, emojis: Sequence[str]):
+        slots = self._channel_slots.setdefault(
+            message.channel.id, asyncio.Semaphore(self.per_channel)
+        )
+
+        async def react(emoji: str):
+            async with slots:
+                await message.add_reaction(emoji)
+
+        results = await asyncio.gather(
+            *(react(emoji) for emoji in emojis), return_exceptions=True
+        )
+        missing = []
+        for emoji, result in zip(emojis, results):
+            match result:
+                case HTTPException() if _is_missing_emoji(result):
+                    missing.append(emoji)
+                case BaseException():
+                    LOG.error(
+                        f"could not react to {message.id} with '{emoji}'",
+                        exc_info=result,
+                    )
+        if missing:
+            # nothing awaits this task, so its exception would go unseen
+            try:
+                await self.on_missing(message, missing)
+            except Exception:
+                LOG.exception(
+                    f"could not remove {missing} after reacting to {message.id}"
+                )
+
+    async def drain(self):
+        """
+        Waits for the reactions that are still in flight.
+        """
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# code points that appear inside emoji sequences without being symbols themselves
+_EMOJI_JOINERS = {
+    0x200D,  # zero width joiner
+    0x20E3,  # combining enclosing keycap
+    0xFE0E,  # text presentation selector
+    0xFE0F,  # emoji presentation selector
+}
+
+
+def _looks_like_unicode_emoji(text: str) -> bool:
+    """
+    Whether `text` is made of symbol characters and the modifiers that join
+    them into emoji sequences. This accepts some symbols that Discord does not
+    react with, but rejects ordinary text.
+    """
+    if not text or len(text) > 16:
+        return False
+    has_symbol = False
+    for i, char in enumerate(text):
+        code = ord(char)
+        if unicodedata.category(char) == "So":
+            has_symbol = True
+        elif code in _EMOJI_JOINERS:
+            pass
+        elif 0x1F3FB <= code <= 0x1F3FF or 0xE0020 <= code <= 0xE007F:
+            # skin tone modifiers and subdivision flag tags
+            pass
+        elif char in "#*0123456789" and i == 0 and len(text) > 1:
+            # keycaps start with the key
+            pass
+        else:
+            return False
+    return has_symbol or text.endswith("⃣")
+
+
+class GuildEmojiIndex:
+    """
+    The ids of the custom emojis of the guild, for checking robomojis before
+    they are stored. Kept current from `on_guild_emojis_update`.
+    Unicode emojis are recognised by their characters.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._custom_ids: frozenset[int] = frozenset()
+
+    def update(self, emojis: Sequence[Emoji]):
+        self._custom_ids = frozenset(emoji.id for emoji in emojis)
+        self.loaded = True
+
+    def is_usable(self, emoji: str) -> bool:
+        """
+        Whether the bot can react with `emoji`, which is either a unicode emoji
+        or a custom emoji of the guild in any format `PartialEmoji.from_str`
+        accepts.
+        """
+        partial = PartialEmoji.from_str(emoji)
+        if partial.id is not None:
+            return partial.id in self._custom_ids
+        return _looks_like_unicode_emoji(partial.name)
@@ -0,0 +1,24 @@
+import pytest
+
+import database
+import database.currency
+import database.predictions
+import database.robomoji
+from database.migrations import run_migrations
+
+
+@pytest.fixture()
+def db_engine(tmp_path):
+    """
+    Points the `database` package at a fresh sqlite file for the test.
+    """
+    engine = database.configure(url=f"sqlite:///{tmp_path / 'underpeel.db'}")
+    run_migrations(engine)
+    database.currency._pending.clear()
+    database.currency.balance_cache.clear()
+    database.currency.leaderboard.stale = True
+    database.robomoji._index.clear()
+    database.robomoji._unflushed_uses.clear()
+    database.predictions._live_predictions.clear()
+    yield engine
+    engine.dispose()
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from discord import TextChannel, Thread
+
+from models.channel_policy import ChannelPolicy
+
+
+def text_channel(channel_id: int, category_id: int | None) -> TextChannel:
+    channel = TextChannel.__new__(TextChannel)
+    channel.id = channel_id
+    channel.category_id = category_id
+    return channel
+
+
+def thread(thread_id: int, parent_id: int, channels: dict[int, TextChannel]) -> Thread:
+    channel = Thread.__new__(Thread)
+    channel.id = thread_id
+    channel.parent_id = parent_id
+    channel.guild = SimpleNamespace(get_channel=channels.get)
+    # read by repr
+    channel.name = f"thread {thread_id}"
+    channel.owner_id = None
+    channel.locked = channel.archived = False
+    return channel
+
+
+def test_verdicts_are_memoized_until_invalidated():
+    policy = ChannelPolicy(excluded_channels=[1], excluded_categories=[10])
+    assert not policy.allows(text_channel(1, None))
+    assert not policy.allows(text_channel(2, 10))
+    assert policy.allows(text_channel(3, 11))
+
+    # channel 3 moved into an excluded category
+    moved = text_channel(3, 10)
+    assert policy.allows(moved)
+    policy.invalidate()
+    assert not policy.allows(moved)
+
+
+def test_threads_with_uncached_parents_are_decided_again():
+    policy = ChannelPolicy(excluded_channels=[], excluded_categories=[10])
+    channels: dict[int, TextChannel] = {}
+    assert not policy.allows(thread(100, 1, channels))
+
+    channels[1] = text_channel(1, 11)
+    assert policy.allows(thread(100, 1, channels))
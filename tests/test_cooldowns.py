@@ -0,0 +1,38 @@
+from models.currency import COOLDOWN_LIFETIME, CurrencyCooldownMap
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_cooldown_blocks_then_accepts():
+    clock = FakeClock()
+    cooldowns = CurrencyCooldownMap(clock)
+    assert cooldowns.try_use_normal(1)
+    assert not cooldowns.try_use_normal(1)
+    assert cooldowns.try_use_stream(1) == "promoted"
+    assert cooldowns.try_use_stream(1) == "blocked"
+    clock.now += COOLDOWN_LIFETIME / 2 + 1
+    assert cooldowns.try_use_stream(1) == "accepted"
+
+
+def test_expired_cooldowns_are_forgotten():
+    clock = FakeClock()
+    cooldowns = CurrencyCooldownMap(clock)
+    cooldowns.try_use_normal(1)
+    cooldowns.try_use_normal(2)
+    clock.now += COOLDOWN_LIFETIME / 2 + 1
+    # moves user 2's window forward, so it expires later than user 1's
+    assert cooldowns.try_use_normal(2)
+
+    clock.now += COOLDOWN_LIFETIME / 2 + 120
+    cooldowns._clean_cache()
+    assert set(cooldowns.map) == {2}
+
+    clock.now += COOLDOWN_LIFETIME
+    cooldowns._clean_cache()
+    assert cooldowns.map == {}
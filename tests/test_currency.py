@@ -0,0 +1,127 @@
+import random
+
+import database.currency as db
+
+
+def test_pending_points_are_read_through(db_engine):
+    db.queue_points_for_user(1, 10)
+    db.queue_points_for_user(1, 5)
+    assert db.get_user_points(1) == 15
+
+    assert db.flush_pending_points() == 1
+    assert db.get_user_points(1) == 15
+
+    db.queue_points_for_user(1, 3)
+    db.queue_points_for_user(2, 7)
+    assert db.flush_pending_points() == 2
+    assert db.get_user_points(1) == 18
+    assert db.get_user_points(2) == 7
+
+
+def test_debit_consumes_pending_points(db_engine):
+    db.add_points_to_user(1, 100)
+    db.queue_points_for_user(1, 10)
+    assert db.add_points_to_user(1, -50, "test debit") == 60
+    assert db.flush_pending_points() == 0
+    assert db.get_user_points(1) == 60
+
+
+def test_conditional_debit_counts_pending_points(db_engine):
+    db.add_points_to_user(1, 40, "seed")
+    db.queue_points_for_user(1, 10)
+    assert db.try_debit_user(1, 60, "too much") is None
+    assert db.get_user_points(1) == 50
+    assert db.try_debit_user(1, 50, "everything") == 0
+    assert db.get_user_points(1) == 0
+    assert db.try_debit_user(2, 1, "no wallet") is None
+
+
+def test_conditional_debit_from_pending_only_wallet(db_engine):
+    db.queue_points_for_user(1, 10)
+    assert db.try_debit_user(1, 11, "too much") is None
+    assert db.get_user_points(1) == 10
+    assert db.try_debit_user(1, 4, "debit") == 6
+    assert db.flush_pending_points() == 0
+    assert db.get_user_points(1) == 6
+
+
+def test_balance_cache_stays_coherent(db_engine):
+    cache = db.balance_cache
+    hits, misses = cache.hits, cache.misses
+    assert db.get_user_points(1) == 0
+    assert (cache.hits - hits, cache.misses - misses) == (0, 1)
+
+    db.add_points_to_user(1, 50, "grant")
+    db.queue_points_for_user(1, 5)
+    db.flush_pending_points()
+    assert db.get_user_points(1) == 55
+    assert (cache.hits - hits, cache.misses - misses) == (1, 1)
+
+
+def test_balance_cache_evicts_least_recently_used():
+    cache = db.BalanceCache(maxsize=2)
+    cache.put(1, 10)
+    cache.put(2, 20)
+    assert cache.get(1) == 10
+    cache.put(3, 30)
+    assert cache.get(2) is None
+    assert cache.get(1) == 10
+    assert cache.get(3) == 30
+
+
+def test_leaderboard_follows_balance_changes(db_engine, monkeypatch):
+    monkeypatch.setattr(db, "leaderboard", db.Leaderboard(capacity=3))
+    for user_id, amount in [(1, 10), (2, 20), (3, 30), (4, 40)]:
+        db.add_points_to_user(user_id, amount)
+    assert db.get_leaderboard(3) == [(4, 40), (3, 30), (2, 20)]
+
+    db.queue_points_for_user(1, 25)
+    db.flush_pending_points()
+    assert db.get_leaderboard(3) == [(4, 40), (1, 35), (3, 30)]
+
+    # the last place drops below a wallet that is not on the leaderboard
+    db.add_points_to_user(3, -25, "test debit")
+    assert db.get_leaderboard(3) == [(4, 40), (1, 35), (2, 20)]
+    assert db.get_rank(2) == 3
+    assert db.get_rank(3) == 4
+    assert db.get_rank(5) is None
+
+
+def test_leaderboard_matches_full_sort():
+    rng = random.Random(0)
+    board = db.Leaderboard(capacity=5)
+    balances: dict[int, int] = {}
+    board.seed([])
+    for _ in range(2000):
+        user_id = rng.randrange(20)
+        balances[user_id] = balances.get(user_id, 0) + rng.randint(-10, 20)
+        board.update(user_id, balances[user_id])
+        if board.stale:
+            board.seed(list(balances.items()))
+        expected = sorted(balances.items(), key=lambda kv: (-kv[1], -kv[0]))[:5]
+        assert board.top(5) == expected
+
+
+def test_transaction_history_pages_do_not_overlap(db_engine):
+    db.add_points_to_user(1, 0)
+    for i in range(7):
+        db.add_points_to_user(1, i, f"grant {i}")
+    newest_first = [t.reason for t in db.get_currency_transactions(1, limit=100)]
+
+    pages = []
+    cursor = None
+    while page := db.get_currency_transactions(1, limit=3, before=cursor):
+        pages.append([t.reason for t in page])
+        cursor = (page[-1].time, page[-1].id)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == newest_first
+
+
+def test_bulk_grant_writes_balances_and_ledger(db_engine):
+    db.add_points_to_user(1, 10)
+    db.queue_points_for_user(2, 3)
+    assert db.add_points_to_users([1, 2, 3], 5, "role grant") == {1: 15, 2: 8, 3: 5}
+    assert [db.get_user_points(user_id) for user_id in [1, 2, 3]] == [15, 8, 5]
+    for user_id in [1, 2, 3]:
+        [transaction] = db.get_currency_transactions(user_id)
+        assert (transaction.delta, transaction.reason) == (5, "role grant")
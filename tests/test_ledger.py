@@ -0,0 +1,81 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+import database.currency as currency
+from database import CurrencyInfo, CurrencyTransaction, make_session
+from database.ledger import (
+    BalanceDivergence,
+    compact_ledger,
+    compact_ledger_month,
+    reconcile_balances,
+)
+
+
+def backdate(reason: str, time: datetime):
+    with make_session() as session, session.begin():
+        session.execute(
+            update(CurrencyTransaction)
+            .where(CurrencyTransaction.reason == reason)
+            .values(time=time)
+        )
+
+
+def test_compaction_archives_old_months(db_engine, tmp_path):
+    currency.add_points_to_user(1, 0)
+    for i, time in enumerate(
+        [datetime(2024, 1, 5), datetime(2024, 1, 20), datetime(2024, 2, 3)]
+    ):
+        currency.add_points_to_user(1, 10 * (i + 1), f"old {i}")
+        backdate(f"old {i}", time)
+    currency.add_points_to_user(1, 5, "recent")
+    before = currency.get_currency_transactions(1, limit=100)
+    assert reconcile_balances() == []
+
+    now = datetime(2024, 3, 10)
+    # one month per call, oldest first
+    assert compact_ledger_month(timedelta(days=7), tmp_path, now=now) == 2
+    assert compact_ledger(timedelta(days=7), tmp_path, now=now) == 1
+
+    history = currency.get_currency_transactions(1, limit=100)
+    assert [t.reason for t in history][0] == "recent"
+    assert [(t.archived_count, t.delta, t.end_amount) for t in history[1:]] == [
+        (1, 30, 60),
+        (2, 30, 30),
+    ]
+    # summaries sort where the newest transaction they replace used to be
+    assert [t.id for t in history] == [before[0].id, before[1].id, before[2].id]
+
+    archives = sorted(tmp_path.glob("*.jsonl.gz"))
+    assert [archive.name for archive in archives] == [
+        "currency_transactions-2024-01.jsonl.gz",
+        "currency_transactions-2024-02.jsonl.gz",
+    ]
+    rows = []
+    for archive in archives:
+        with gzip.open(archive, "rt") as f:
+            rows += [json.loads(line) for line in f]
+    assert [row["reason"] for row in rows] == ["old 0", "old 1", "old 2"]
+
+    assert compact_ledger(timedelta(days=7), tmp_path, now=now) == 0
+
+
+def test_reconciliation_only_reads_new_transactions(db_engine):
+    currency.add_points_to_user(1, 100, "starting balance")
+    currency.queue_points_for_user(1, 7)
+    currency.queue_points_for_user(2, 3)
+    currency.flush_pending_points()
+    currency.add_points_to_users([1, 2], 10, "grant")
+    assert reconcile_balances() == []
+    assert reconcile_balances() == []
+
+    with make_session() as session, session.begin():
+        session.execute(
+            update(CurrencyInfo)
+            .where(CurrencyInfo.user_id == 2)
+            .values(amount=CurrencyInfo.amount + 1)
+        )
+    currency.add_points_to_user(2, -5, "spent")
+    assert reconcile_balances() == [BalanceDivergence(2, amount=9, expected=8)]
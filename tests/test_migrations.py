@@ -0,0 +1,175 @@
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import database.migrations as migrations
+
+from database.migrations import SCHEMA_VERSION, get_schema_version, run_migrations
+
+# the schema as created by `create_all` before migrations were introduced
+LEGACY_SCHEMA = [
+    """CREATE TABLE currency (
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        PRIMARY KEY (user_id)
+    )""",
+    """CREATE TABLE currency_transactions (
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        time DATETIME NOT NULL,
+        delta INTEGER NOT NULL,
+        end_amount INTEGER NOT NULL,
+        reason VARCHAR NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE TABLE predictions (
+        message_id INTEGER NOT NULL,
+        title VARCHAR NOT NULL,
+        status VARCHAR(8) NOT NULL,
+        choice_a VARCHAR NOT NULL,
+        choice_b VARCHAR NOT NULL,
+        winner VARCHAR(1),
+        PRIMARY KEY (message_id)
+    )""",
+    """CREATE TABLE riot_ids (
+        user_id INTEGER NOT NULL,
+        game_name VARCHAR NOT NULL,
+        tagline VARCHAR NOT NULL,
+        PRIMARY KEY (user_id)
+    )""",
+    """CREATE TABLE robomoji_info (
+        user_id INTEGER NOT NULL,
+        last_reacted DATETIME NOT NULL,
+        PRIMARY KEY (user_id)
+    )""",
+    """CREATE TABLE robomoji_transactions (
+        id INTEGER NOT NULL,
+        chatter_id INTEGER NOT NULL,
+        emoji VARCHAR NOT NULL,
+        time DATETIME NOT NULL,
+        system BOOLEAN NOT NULL,
+        staff_id INTEGER,
+        reason VARCHAR NOT NULL,
+        action VARCHAR(7) NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT system_or_staff CHECK (system != (staff_id IS NOT NULL))
+    )""",
+    """CREATE TABLE prediction_votes (
+        id INTEGER NOT NULL,
+        prediction INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        choice VARCHAR(1) NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(prediction) REFERENCES predictions (message_id)
+    )""",
+    """CREATE TABLE robomojis (
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        emoji VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES robomoji_info (user_id)
+    )""",
+]
+
+
+@pytest.fixture
+def legacy_engine(tmp_path):
+    """
+    An unmigrated sqlite file with the tables of `LEGACY_SCHEMA`.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.exec_driver_sql(statement)
+    yield engine
+    engine.dispose()
+
+
+def describe_schema(engine):
+    inspector = inspect(engine)
+    return {
+        table: (
+            {column["name"] for column in inspector.get_columns(table)},
+            {
+                (index["name"], tuple(index["column_names"]), index["unique"])
+                for index in inspector.get_indexes(table)
+            },
+        )
+        for table in inspector.get_table_names()
+    }
+
+
+def test_fresh_database_is_stamped(db_engine):
+    with db_engine.connect() as connection:
+        assert get_schema_version(connection) == SCHEMA_VERSION
+        assert "currency" in inspect(connection).get_table_names()
+
+
+def test_migrations_are_idempotent(db_engine):
+    assert run_migrations(db_engine) == SCHEMA_VERSION
+    with db_engine.connect() as connection:
+        assert get_schema_version(connection) == SCHEMA_VERSION
+
+
+def test_legacy_database_matches_fresh_schema(db_engine, legacy_engine):
+    assert run_migrations(legacy_engine) == 0
+    with legacy_engine.connect() as connection:
+        assert get_schema_version(connection) == SCHEMA_VERSION
+    assert describe_schema(legacy_engine) == describe_schema(db_engine)
+
+
+def test_prediction_totals_are_backfilled(legacy_engine):
+    with legacy_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO predictions VALUES (5, 't', 'OPEN', 'a', 'b', NULL)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO prediction_votes (prediction, user_id, amount, choice) "
+            "VALUES (5, 1, 10, 'A'), (5, 2, 15, 'A'), (5, 3, 20, 'B')"
+        )
+
+    run_migrations(legacy_engine)
+    with legacy_engine.connect() as connection:
+        totals = connection.exec_driver_sql(
+            "SELECT total_a, total_b FROM predictions"
+        ).one()
+    assert tuple(totals) == (25, 20)
+
+
+def test_duplicate_votes_are_consolidated(legacy_engine):
+    with legacy_engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO predictions VALUES (5, 't', 'OPEN', 'a', 'b', NULL)"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO prediction_votes (prediction, user_id, amount, choice) "
+            "VALUES (5, 1, 10, 'A'), (5, 1, 15, 'A'), (5, 1, 20, 'B'), (5, 2, 5, 'A')"
+        )
+
+    run_migrations(legacy_engine)
+    with legacy_engine.connect() as connection:
+        votes = connection.exec_driver_sql(
+            "SELECT user_id, choice, amount FROM prediction_votes ORDER BY id"
+        ).all()
+    assert [tuple(vote) for vote in votes] == [(1, "A", 25), (1, "B", 20), (2, "A", 5)]
+
+
+def test_failed_migration_leaves_no_trace(legacy_engine, monkeypatch):
+    def fail(connection):
+        raise RuntimeError("migration failed")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [*migrations.MIGRATIONS[:3], fail])
+    with pytest.raises(RuntimeError):
+        run_migrations(legacy_engine)
+    with legacy_engine.connect() as connection:
+        assert get_schema_version(connection) == 0
+    columns = {
+        column["name"]
+        for column in inspect(legacy_engine).get_columns("currency_transactions")
+    }
+    assert "archived_count" not in columns
+
+    monkeypatch.undo()
+    assert run_migrations(legacy_engine) == 0
+    with legacy_engine.connect() as connection:
+        assert get_schema_version(connection) == SCHEMA_VERSION
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import time
+
+import database.predictions as db
+from database import PredictionChoice, PredictionStatus, make_session
+from database.currency import (
+    _try_debit,
+    add_points_to_user,
+    get_currency_transactions,
+    get_user_points,
+    queue_points_for_user,
+)
+from database.ledger import reconcile_balances
+
+
+def test_live_predictions_are_cached(db_engine):
+    add_points_to_user(1, 100, "seed")
+    add_points_to_user(2, 100, "seed")
+    db.create_prediction(5, "title", "yes", "no")
+    db.create_prediction(6, "other", "yes", "no")
+    db.create_prediction(7, "paid", "yes", "no")
+    db.add_prediction_vote(5, 1, PredictionChoice.A, 10)
+    db.add_prediction_vote(5, 2, PredictionChoice.B, 20)
+    db.add_prediction_vote(6, 1, PredictionChoice.B, 5)
+    db.close_prediction(6)
+    db.close_prediction(7)
+    db.refund_prediction(7)
+
+    expected = {
+        5: db.LivePrediction(5, "title", "yes", "no", votes_a=10, votes_b=20),
+        6: db.LivePrediction(
+            6, "other", "yes", "no", status=PredictionStatus.CLOSED, votes_b=5
+        ),
+    }
+    assert db._live_predictions == expected
+    assert db.get_open_prediction(5) == expected[5]
+    assert db.get_open_prediction(6) is None
+    assert db.get_live_prediction(6) == expected[6]
+    assert db.get_live_prediction(7) is None
+
+    db._live_predictions.clear()
+    db.load_live_predictions()
+    assert db._live_predictions == expected
+
+
+def test_vote_totals_match_votes(db_engine):
+    add_points_to_user(1, 100, "seed")
+    add_points_to_user(2, 100, "seed")
+    db.create_prediction(5, "title", "yes", "no")
+    db.add_prediction_vote(5, 1, PredictionChoice.A, 10)
+    db.add_prediction_vote(5, 2, PredictionChoice.A, 15)
+    summary = db.add_prediction_vote(5, 2, PredictionChoice.B, 20)
+
+    assert summary == {PredictionChoice.A: 25, PredictionChoice.B: 20}
+    assert db.check_prediction_totals() == []
+
+    with db_engine.begin() as connection:
+        connection.exec_driver_sql("UPDATE predictions SET total_b = 7")
+    assert db.check_prediction_totals() == [
+        db.TotalsDivergence(5, PredictionChoice.B, 7, 20)
+    ]
+
+
+def test_payout_splits_the_pot_in_one_transaction(db_engine):
+    for user_id in (1, 2, 3):
+        add_points_to_user(user_id, 100, "seed")
+    db.create_prediction(5, "title", "yes", "no")
+    db.add_prediction_vote(5, 1, PredictionChoice.A, 10)
+    db.add_prediction_vote(5, 1, PredictionChoice.A, 10)
+    db.add_prediction_vote(5, 2, PredictionChoice.A, 10)
+    db.add_prediction_vote(5, 3, PredictionChoice.B, 11)
+    db.close_prediction(5)
+
+    db.pay_out_prediction(5, PredictionChoice.A)
+
+    # the pot of 41 is split 2:1, rounding up
+    assert get_user_points(1) == 80 + 28
+    assert get_user_points(2) == 90 + 14
+    assert get_user_points(3) == 89
+    assert [t.reason for t in get_currency_transactions(1, limit=1)] == [
+        "prediction 5 payout"
+    ]
+    assert reconcile_balances() == []
+    assert db.pay_out_prediction(5, PredictionChoice.A) == (
+        "prediction has already been paid out"
+    )
+
+
+def test_payout_without_winners_refunds(db_engine):
+    add_points_to_user(1, 100, "seed")
+    db.create_prediction(5, "title", "yes", "no")
+    db.add_prediction_vote(5, 1, PredictionChoice.A, 10)
+    db.add_prediction_vote(5, 1, PredictionChoice.A, 5)
+    db.close_prediction(5)
+
+    result, _ = db.pay_out_prediction(5, PredictionChoice.B)
+    assert result == "prediction has no winners"
+    assert get_user_points(1) == 100
+    assert db.get_prediction(5).status == PredictionStatus.REFUNDED
+
+
+def test_concurrent_votes_never_overdraw(db_engine):
+    add_points_to_user(1, 100, "seed")
+    db.create_prediction(5, "title", "yes", "no")
+
+    def vote(i: int):
+        choice = PredictionChoice.A if i % 2 else PredictionChoice.B
+        return db.add_prediction_vote(5, 1, choice, 7)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(vote, range(40)))
+
+    accepted = [result for result in results if result != "not enough points"]
+    assert len(accepted) == 100 // 7
+    assert get_user_points(1) == 100 % 7
+    prediction = db.get_prediction(5)
+    assert prediction.total_a + prediction.total_b == 7 * len(accepted)
+    assert db.check_prediction_totals() == []
+    assert reconcile_balances() == []
+
+
+def test_debit_condition_alone_prevents_overdraw(db_engine):
+    # two transactions race for the same wallet without _flush_lock;
+    # the second UPDATE waits for the first to commit and then sees its debit
+    add_points_to_user(1, 100, "seed")
+    first_debited = Event()
+
+    def first():
+        with make_session() as session, session.begin():
+            new_amount = _try_debit(session, 1, 70, "first")
+            first_debited.set()
+            time.sleep(0.2)
+        return new_amount
+
+    def second():
+        first_debited.wait()
+        with make_session() as session, session.begin():
+            return _try_debit(session, 1, 70, "second")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = [executor.submit(first), executor.submit(second)]
+        assert [result.result() for result in results] == [30, None]
+
+    assert [t.reason for t in get_currency_transactions(1, limit=10)] == [
+        "first",
+        "seed",
+    ]
+    assert reconcile_balances() == []
+
+
+def test_repeated_votes_share_a_row(db_engine):
+    add_points_to_user(1, 100, "seed")
+    db.create_prediction(5, "title", "yes", "no")
+    for amount in (10, 5, 1):
+        db.add_prediction_vote(5, 1, PredictionChoice.A, amount)
+    db.add_prediction_vote(5, 1, PredictionChoice.B, 4)
+
+    votes = db.get_prediction(5).votes
+    assert sorted((vote.choice.value, vote.amount) for vote in votes) == [
+        ("a", 16),
+        ("b", 4),
+    ]
+    # every vote is still in the ledger
+    assert len(get_currency_transactions(1)) == 5
+
+
+def test_vote_from_pending_only_wallet(db_engine):
+    queue_points_for_user(1, 10)
+    db.create_prediction(5, "title", "yes", "no")
+    assert db.add_prediction_vote(5, 1, PredictionChoice.A, 5) == {
+        PredictionChoice.A: 5,
+        PredictionChoice.B: 0,
+    }
+    assert get_user_points(1) == 5
+    assert reconcile_balances() == []
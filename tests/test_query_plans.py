@@ -0,0 +1,156 @@
+"""
+Runs every query issued by the `database` package through EXPLAIN QUERY PLAN and
+fails if any of them has to scan a whole table.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+import database.currency as currency
+import database.ledger as ledger
+import database.predictions as predictions
+import database.robomoji as robomoji
+import database.valorant as valorant
+from database import PredictionChoice
+
+
+def is_full_scan(statement: str, detail: str) -> bool:
+    """
+    Whether a line of EXPLAIN QUERY PLAN output means a query is not served by
+    an index: a scan of a table, a scan of a whole index (unless the query is
+    bounded by a LIMIT, so the scan stops early), a sort or grouping done in a
+    temporary b-tree, or an index that sqlite had to build on the fly.
+    """
+    if detail.startswith("SCAN "):
+        walks_index = " USING INDEX " in detail or " USING COVERING INDEX " in detail
+        return not (walks_index and " LIMIT " in statement)
+    return detail.startswith("USE TEMP B-TREE") or "AUTOMATIC" in detail
+
+
+@contextmanager
+def captured_queries(engine):
+    queries: list[tuple[str, tuple]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(
+            ("SELECT", "UPDATE", "DELETE")
+        ):
+            queries.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+
+def full_scans(engine, queries):
+    bad = []
+    with engine.connect() as connection:
+        for statement, parameters in queries:
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).all()
+            bad.extend(
+                (statement, detail)
+                for *_, detail in plan
+                if is_full_scan(statement, detail)
+            )
+    return bad
+
+
+SCENARIO = [
+    ("add_points_to_user", lambda: currency.add_points_to_user(1, 100, "seed")),
+    ("add_points_to_user", lambda: currency.add_points_to_user(2, 100, "seed")),
+    ("add_points_to_users", lambda: currency.add_points_to_users([1, 3], 5, "grant")),
+    ("queue_points_for_user", lambda: currency.queue_points_for_user(1, 5)),
+    ("flush_pending_points", currency.flush_pending_points),
+    ("get_user_points", lambda: currency.get_user_points(1)),
+    ("try_debit_user", lambda: currency.try_debit_user(1, 5, "debit")),
+    ("get_currency_transactions", lambda: currency.get_currency_transactions(1)),
+    (
+        "get_currency_transactions",
+        lambda: currency.get_currency_transactions(1, before=(datetime.now(), 10)),
+    ),
+    ("reconcile_balances", ledger.reconcile_balances),
+    (
+        "compact_ledger",
+        lambda: ledger.compact_ledger(timedelta(0), now=datetime(2100, 1, 1)),
+    ),
+    ("get_leaderboard", currency.get_leaderboard),
+    ("get_rank", lambda: currency.get_rank(1)),
+    ("toggle_emoji", lambda: robomoji.toggle_emoji(10, 1, "🍌", "test")),
+    ("get_emoji_info", lambda: robomoji.get_emoji_info(1)),
+    ("load_emoji_index", robomoji.load_emoji_index),
+    ("use_emojis", lambda: robomoji.use_emojis(1, timedelta(0))),
+    ("flush_emoji_uses", robomoji.flush_emoji_uses),
+    (
+        "remove_missing_emojis",
+        lambda: robomoji.remove_missing_emojis(1, ["🍌"], "test"),
+    ),
+    (
+        "remove_emojis_everywhere",
+        lambda: robomoji.remove_emojis_everywhere(["🍌"], "test"),
+    ),
+    ("get_emoji_changes", lambda: robomoji.get_emoji_changes(1)),
+    (
+        "get_emoji_changes",
+        lambda: robomoji.get_emoji_changes(1, before=(datetime.now(), 10)),
+    ),
+    ("set_riot_id", lambda: valorant.set_riot_id(1, "name", "tag")),
+    ("get_riot_id", lambda: valorant.get_riot_id(1)),
+    ("clear_riot_id", lambda: valorant.clear_riot_id(1)),
+    ("create_prediction", lambda: predictions.create_prediction(5, "t", "a", "b")),
+    (
+        "add_prediction_vote",
+        lambda: predictions.add_prediction_vote(5, 1, PredictionChoice.A, 10),
+    ),
+    (
+        "add_prediction_vote",
+        lambda: predictions.add_prediction_vote(5, 2, PredictionChoice.B, 20),
+    ),
+    ("get_prediction", lambda: predictions.get_prediction(5)),
+    ("load_live_predictions", predictions.load_live_predictions),
+    ("check_prediction_totals", predictions.check_prediction_totals),
+    ("close_prediction", lambda: predictions.close_prediction(5)),
+    (
+        "pay_out_prediction",
+        lambda: predictions.pay_out_prediction(5, PredictionChoice.A),
+    ),
+    ("create_prediction", lambda: predictions.create_prediction(6, "t", "a", "b")),
+    (
+        "add_prediction_vote",
+        lambda: predictions.add_prediction_vote(6, 1, PredictionChoice.A, 10),
+    ),
+    ("close_prediction", lambda: predictions.close_prediction(6)),
+    ("refund_prediction", lambda: predictions.refund_prediction(6)),
+]
+
+
+# startup loads and background jobs that are expected to read whole tables
+FULL_SCANS_ALLOWED = {
+    "load_emoji_index",
+    "load_live_predictions",
+    "check_prediction_totals",
+    "remove_emojis_everywhere",
+    "compact_ledger",
+}
+
+
+@pytest.mark.parametrize(
+    "step", range(len(SCENARIO)), ids=[name for name, _ in SCENARIO]
+)
+def test_queries_use_indexes(db_engine, tmp_path, monkeypatch, step):
+    # keeps ledger archives out of the repository
+    monkeypatch.chdir(tmp_path)
+    # earlier steps set up the state the step under test needs
+    for _, fn in SCENARIO[:step]:
+        fn()
+    name, fn = SCENARIO[step]
+    with captured_queries(db_engine) as queries:
+        fn()
+    if name not in FULL_SCANS_ALLOWED:
+        assert full_scans(db_engine, queries) == []
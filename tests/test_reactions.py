@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from discord import HTTPException
+
+from models.robomoji import GuildEmojiIndex, ReactionDispatcher
+
+
+class FakeMessage:
+    def __init__(self, missing: set[str]):
+        self.id = 1
+        self.channel = SimpleNamespace(id=2)
+        self.missing = missing
+        self.reactions: list[str] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def add_reaction(self, emoji: str):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        if emoji in self.missing:
+            response = SimpleNamespace(status=400, reason="Bad Request")
+            raise HTTPException(response, {"code": 10014, "message": "Unknown Emoji"})
+        self.reactions.append(emoji)
+
+
+@pytest.mark.asyncio
+async def test_reactions_are_concurrent_and_missing_emojis_are_batched():
+    batches = []
+
+    async def on_missing(message, emojis):
+        batches.append(emojis)
+
+    dispatcher = ReactionDispatcher(on_missing, per_channel=2)
+    message = FakeMessage(missing={"b", "d"})
+    dispatcher.dispatch(message, ["a", "b", "c", "d", "e"])
+    await dispatcher.drain()
+
+    assert sorted(message.reactions) == ["a", "c", "e"]
+    assert message.max_in_flight == 2
+    assert batches == [["b", "d"]]
+
+
+@pytest.mark.asyncio
+async def test_failed_missing_emoji_handler_is_logged(caplog):
+    async def on_missing(message, emojis):
+        raise RuntimeError("database is gone")
+
+    dispatcher = ReactionDispatcher(on_missing)
+    dispatcher.dispatch(FakeMessage(missing={"b"}), ["a", "b"])
+    await dispatcher.drain()
+
+    [record] = caplog.records
+    assert record.exc_info[0] is RuntimeError
+
+
+def test_guild_emoji_index():
+    index = GuildEmojiIndex()
+    index.update([SimpleNamespace(id=1234567890123456789)])
+    assert index.is_usable("<:peel:1234567890123456789>")
+    assert index.is_usable("<a:peel:1234567890123456789>")
+    assert not index.is_usable("<:other:1234567890123456000>")
+    for emoji in ("🍌", "👍🏽", "❤️", "1️⃣", "🏳️‍🌈", "🇺🇸"):
+        assert index.is_usable(emoji), emoji
+    for text in ("banana", ":banana:", "1", ""):
+        assert not index.is_usable(text), text
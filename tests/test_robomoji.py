@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import database.robomoji as db
+
+
+def test_index_follows_toggles(db_engine):
+    db.toggle_emoji(10, 1, "🍌", "test")
+    db.toggle_emoji(10, 1, "🍎", "test")
+    db.toggle_emoji(10, 2, "🍐", "test")
+    db.toggle_emoji(10, 2, "🍐", "test")
+    assert db.get_cached_emojis(1).emojis == ("🍌", "🍎")
+    assert db.get_cached_emojis(2) is None
+
+    db._index.clear()
+    db.load_emoji_index()
+    assert db.get_cached_emojis(1).emojis == ("🍌", "🍎")
+    assert db.get_cached_emojis(2) is None
+    assert db.get_cached_emojis(3) is None
+
+
+def test_uses_are_flushed_in_batches(db_engine):
+    cooldown = timedelta(seconds=30)
+    db.toggle_emoji(10, 1, "🍌", "test")
+    db.toggle_emoji(10, 2, "🍎", "test")
+
+    assert db.use_emojis(1, cooldown) == ("🍌",)
+    assert db.use_emojis(1, cooldown) == ()
+    assert db.use_emojis(2, cooldown) == ("🍎",)
+    assert db.use_emojis(3, cooldown) == ()
+    assert db.get_emoji_info(1).last_reacted == datetime.min
+
+    assert db.flush_emoji_uses() == 2
+    assert db.flush_emoji_uses() == 0
+    assert db.get_emoji_info(1).last_reacted > datetime.now() - cooldown
+
+    # the cooldown survives a restart
+    db._index.clear()
+    db.load_emoji_index()
+    assert db.use_emojis(1, cooldown) == ()
+
+
+def test_remove_missing_emojis(db_engine):
+    for emoji in ("🍌", "🍎", "🍐"):
+        db.toggle_emoji(10, 1, emoji, "test")
+
+    assert db.remove_missing_emojis(1, ["🍌", "🍐", "🥝"], "gone") == ["🍌", "🍐"]
+    assert db.get_cached_emojis(1).emojis == ("🍎",)
+    assert [robomoji.emoji for robomoji in db.get_emoji_info(1).robomojis] == ["🍎"]
+    changes = db.get_emoji_changes(1)
+    assert [(change.emoji, change.system) for change in changes[:2]] == [
+        ("🍐", True),
+        ("🍌", True),
+    ]
+
+    assert db.remove_missing_emojis(1, ["🍎"], "gone") == ["🍎"]
+    assert db.get_cached_emojis(1) is None
+
+
+def test_remove_emojis_everywhere(db_engine):
+    db.toggle_emoji(10, 1, "<:peel:1234567890123456789>", "test")
+    db.toggle_emoji(10, 1, "🍎", "test")
+    db.toggle_emoji(10, 2, "<:peel:1234567890123456789>", "test")
+
+    removed = db.remove_emojis_everywhere({"<:peel:1234567890123456789>"}, "deleted")
+    assert removed == {
+        1: ["<:peel:1234567890123456789>"],
+        2: ["<:peel:1234567890123456789>"],
+    }
+    assert db.get_cached_emojis(1).emojis == ("🍎",)
+    assert db.get_cached_emojis(2) is None
+    assert db.get_all_cached_emojis() == {"🍎"}
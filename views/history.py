@@ -0,0 +1,87 @@
+from datetime import datetime
+from typing import Awaitable, Callable, Generic, Protocol, Sequence, TypeVar
+
+from discord import AllowedMentions, Embed, Interaction, ui
+
+HistoryCursor = tuple[datetime, int]
+
+
+class HistoryEntry(Protocol):
+    time: datetime
+    id: int
+
+
+T = TypeVar("T", bound=HistoryEntry)
+
+
+class HistoryPager(ui.View, Generic[T]):
+    """
+    Pages through a history, newest first, fetching one page per button press.
+
+    `fetch(before, limit)` must return up to `limit` entries older than the
+    `(time, id)` cursor `before`, newest first.
+    `render(entries)` turns a page into the message content or embed.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        fetch: Callable[[HistoryCursor | None, int], Awaitable[Sequence[T]]],
+        render: Callable[[Sequence[T]], str | Embed],
+        page_size: int = 15,
+    ):
+        super().__init__(timeout=300)
+        self.user_id = user_id
+        self.fetch = fetch
+        self.render = render
+        self.page_size = page_size
+
+        # cursors of the pages before the current one; None is the first page
+        self.previous_cursors: list[HistoryCursor | None] = []
+        self.cursor: HistoryCursor | None = None
+        self.next_cursor: HistoryCursor | None = None
+        self.interaction: Interaction | None = None
+
+    async def _load_page(self) -> dict[str, str | Embed]:
+        # one extra entry tells whether there is a next page
+        entries = await self.fetch(self.cursor, self.page_size + 1)
+        page = entries[: self.page_size]
+        self.next_cursor = (page[-1].time, page[-1].id) if page else None
+
+        self.previous_page.disabled = not self.previous_cursors
+        self.next_page.disabled = len(entries) <= self.page_size
+        match self.render(page):
+            case Embed() as embed:
+                return {"embed": embed}
+            case content:
+                return {"content": content}
+
+    async def send(self, interaction: Interaction, ephemeral: bool = False):
+        self.interaction = interaction
+        message = await self._load_page()
+        await interaction.response.send_message(
+            **message,
+            view=self,
+            ephemeral=ephemeral,
+            allowed_mentions=AllowedMentions.none(),
+        )
+
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        return interaction.user.id == self.user_id
+
+    async def on_timeout(self):
+        if self.interaction is not None:
+            await self.interaction.edit_original_response(view=None)
+
+    @ui.button(label="Newer", emoji="◀️")
+    async def previous_page(self, interaction: Interaction, _: ui.Button):
+        self.cursor = self.previous_cursors.pop()
+        message = await self._load_page()
+        await interaction.response.edit_message(**message, view=self)
+
+    @ui.button(label="Older", emoji="▶️")
+    async def next_page(self, interaction: Interaction, _: ui.Button):
+        self.previous_cursors.append(self.cursor)
+        self.cursor = self.next_cursor
+        message = await self._load_page()
+        await interaction.response.edit_message(**message, view=self)
@@ -1,8 +1,36 @@
-from discord import AllowedMentions, Interaction, ui
+import asyncio
+import logging
+import re
+from dataclasses import replace
+from datetime import timedelta
+from typing import Generic, Hashable, Self, TypeVar
+
+from discord import (
+    AllowedMentions,
+    Client,
+    HTTPException,
+    Interaction,
+    Message,
+    Thread,
+    ui,
+)
 
 import database.predictions as db
+from config import CONFIG
+from database import to_thread
+from database.currency import get_user_points
 from models.prediction import PredictionInfo, _pluralize
 
+LOG = logging.getLogger(__name__)
+
+PREDICTION_RENDER_INTERVAL = timedelta(
+    seconds=CONFIG.get("prediction_render_interval_seconds", 2)
+)
+PREDICTION_DIGEST_INTERVAL = timedelta(
+    seconds=CONFIG.get("prediction_digest_interval_seconds", 5)
+)
+MESSAGE_LIMIT = 2000
+
 
 class PredictionView(ui.View):
     def __init__(self, info: PredictionInfo):
@@ -18,23 +46,215 @@ class PredictionView(ui.View):
             label_a = f"{info.choice_a} (×{a_payout:.2f})"
             label_b = f"{info.choice_b} (×{b_payout:.2f})"
 
-        # callbacks in PredictionsCog.on_interaction for presistence over bot restarts
+        disabled = info.status != db.PredictionStatus.OPEN
         self.add_item(
-            ui.Button(
-                label=label_a,
-                custom_id=f"up_prediction:{info.message.id}:a",
-                disabled=info.status != db.PredictionStatus.OPEN,
+            PredictionChoiceButton(
+                info.message.id, db.PredictionChoice.A, label_a, disabled
             )
         )
         self.add_item(
+            PredictionChoiceButton(
+                info.message.id, db.PredictionChoice.B, label_b, disabled
+            )
+        )
+
+
+class PredictionChoiceButton(
+    ui.DynamicItem[ui.Button],
+    template=r"up_prediction:(?P<message_id>\d+):(?P<choice>[ab])",
+):
+    """
+    Opens the vote prompt for one choice of a prediction.
+    Registered with `Bot.add_dynamic_items` so it keeps working across restarts.
+    """
+
+    def __init__(
+        self,
+        message_id: int,
+        choice: db.PredictionChoice,
+        label: str | None = None,
+        disabled: bool = False,
+    ):
+        super().__init__(
             ui.Button(
-                label=label_b,
-                custom_id=f"up_prediction:{info.message.id}:b",
-                disabled=info.status != db.PredictionStatus.OPEN,
+                label=label,
+                custom_id=f"up_prediction:{message_id}:{choice.value}",
+                disabled=disabled,
+            )
+        )
+        self.message_id = message_id
+        self.choice = choice
+
+    @classmethod
+    async def from_custom_id(
+        cls, interaction: Interaction, item: ui.Button, match: re.Match[str]
+    ) -> Self:
+        return cls(int(match["message_id"]), db.PredictionChoice(match["choice"]))
+
+    async def callback(self, interaction: Interaction):
+        prediction = db.get_open_prediction(self.message_id)
+        if prediction is None:
+            await interaction.response.send_message(
+                "prediction is no longer open", ephemeral=True
+            )
+            return
+
+        assert interaction.message is not None
+        info = PredictionInfo.from_live(prediction, interaction.message)
+        await interaction.response.send_modal(
+            PredictionAmountPrompt(
+                info,
+                self.choice,
+                user_balance=await to_thread(get_user_points, interaction.user.id),
             )
         )
 
 
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class _Coalescer(Generic[K, V]):
+    """
+    Runs `_flush(key, pending)` at most once per `interval` for each key, with
+    what was queued for the key since its last flush. Subclasses queue into
+    `_pending` and call `_start`; a key's task ends once nothing is queued.
+    """
+
+    def __init__(self, interval: timedelta):
+        self.interval = interval
+        self._pending: dict[K, V] = {}
+        self._tasks: dict[K, asyncio.Task] = {}
+        self._draining = asyncio.Event()
+
+    def _start(self, key: K):
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    def _cancel(self, key: K):
+        self._pending.pop(key, None)
+        if (task := self._tasks.pop(key, None)) is not None:
+            task.cancel()
+
+    async def _run(self, key: K):
+        try:
+            # what is queued during a flush goes out after the next tick
+            while key in self._pending:
+                try:
+                    await asyncio.wait_for(
+                        self._draining.wait(), self.interval.total_seconds()
+                    )
+                except TimeoutError:
+                    pass
+                await self._flush(key, self._pending.pop(key))
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    async def _flush(self, key: K, pending: V):
+        raise NotImplementedError
+
+    async def drain(self):
+        """
+        Flushes everything queued now and waits for it.
+        """
+        self._draining.set()
+        try:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        finally:
+            self._draining.clear()
+
+
+class PredictionRenderer(_Coalescer[int, PredictionInfo]):
+    """
+    Coalesces the embed and view edits of prediction messages, so that a
+    message is edited at most once per `interval` however many votes come in.
+
+    Renders use the message and embed held in the latest `PredictionInfo` and
+    the vote totals cached by `database.predictions`, without fetching the
+    message again.
+    """
+
+    def schedule(self, info: PredictionInfo):
+        self._pending[info.message.id] = info
+        self._start(info.message.id)
+
+    def cancel(self, message_id: int):
+        """
+        Drops the pending edit of a message that is about to be edited otherwise.
+        """
+        self._cancel(message_id)
+
+    async def _flush(self, message_id: int, info: PredictionInfo):
+        if (prediction := db.get_open_prediction(message_id)) is None:
+            # closed in the meantime; closing renders the final totals
+            return
+        info = replace(info, votes_a=prediction.votes_a, votes_b=prediction.votes_b)
+        base_embed = info.message.embeds[0] if info.message.embeds else None
+        try:
+            await info.message.edit(
+                embed=info.make_embed(base_embed), view=PredictionView(info)
+            )
+        except Exception:
+            LOG.exception(f"could not update prediction {message_id}")
+
+
+prediction_renderer = PredictionRenderer(PREDICTION_RENDER_INTERVAL)
+
+
+class ThreadDigest(_Coalescer[Thread, list[str]]):
+    """
+    Groups notices for a thread into one message per `interval`, split only
+    where a message would exceed Discord's length limit.
+
+    Only routine notices go through the digest. Announcements such as closing
+    and payouts are sent to the thread directly, so they are never queued
+    behind buffered notices.
+    """
+
+    def add(self, thread: Thread, line: str):
+        # threads compare by id, so notices for one thread share a key
+        self._pending.setdefault(thread, []).append(line[:MESSAGE_LIMIT])
+        self._start(thread)
+
+    async def _flush(self, thread: Thread, lines: list[str]):
+        for content in _join_lines(lines):
+            try:
+                await thread.send(content, allowed_mentions=AllowedMentions.none())
+            except Exception:
+                LOG.exception(f"could not send digest to {thread.id}")
+
+
+def _join_lines(lines: list[str]) -> list[str]:
+    messages: list[str] = []
+    current = ""
+    for line in lines:
+        if current and len(current) + 1 + len(line) > MESSAGE_LIMIT:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+prediction_digest = ThreadDigest(PREDICTION_DIGEST_INTERVAL)
+
+
+async def _prediction_thread(client: Client, message: Message) -> Thread | None:
+    """
+    Returns the thread started from a prediction message. The thread shares the
+    message's id; archived threads are not cached and have to be fetched.
+    """
+    if message.guild is not None and (thread := message.guild.get_thread(message.id)):
+        return thread
+    try:
+        channel = await client.fetch_channel(message.id)
+    except HTTPException:
+        return None
+    return channel if isinstance(channel, Thread) else None
+
+
 class PredictionAmountPrompt(ui.Modal):
     def __init__(
         self,
@@ -63,7 +283,8 @@ class PredictionAmountPrompt(ui.Modal):
                 "amount must be a positive integer", ephemeral=True
             )
             return
-        response = db.add_prediction_vote(
+        response = await to_thread(
+            db.add_prediction_vote,
             message_id=self.info.message.id,
             user_id=interaction.user.id,
             choice=self.choice,
@@ -98,17 +319,15 @@ class PredictionAmountPrompt(ui.Modal):
             f"You put {self.amount} on {choice_name}", ephemeral=True
         )
 
-        message = await self.info.message.fetch()
-        assert message is not None and len(message.embeds) == 1
-        [embed] = message.embeds
-        new_embed = self.info.make_embed(embed)
-        new_view = PredictionView(self.info)
-        await message.edit(embed=new_embed, view=new_view)
+        prediction_renderer.schedule(self.info)
 
-        assert message.thread is not None
-        await message.thread.send(
+        thread = await _prediction_thread(interaction.client, self.info.message)
+        if thread is None:
+            LOG.error(f"could not find the thread of prediction {self.info.message.id}")
+            return
+        prediction_digest.add(
+            thread,
             f"{interaction.user.mention} put {_pluralize(amount, 'peel')} on {choice_name}",
-            allowed_mentions=AllowedMentions.none(),
         )
 
 
@@ -119,7 +338,8 @@ class PredictionCloseControls(ui.View):
 
     @ui.button(label="Close Prediction", emoji="🚫")
     async def close_prediction(self, interaction: Interaction, _: ui.Button):
-        result = db.close_prediction(self.info.message.id)
+        result = await to_thread(db.close_prediction, self.info.message.id)
+        final_totals = False
         match result:
             case "prediction has already been closed":
                 await interaction.response.edit_message(
@@ -131,14 +351,22 @@ class PredictionCloseControls(ui.View):
             case updated_prediction_info:
                 self.info.votes_a = updated_prediction_info[db.PredictionChoice.A]
                 self.info.votes_b = updated_prediction_info[db.PredictionChoice.B]
+                final_totals = True
 
-        # disable voting buttons
+        # disable voting buttons, rendering the votes that were still pending
+        prediction_renderer.cancel(self.info.message.id)
         message = await self.info.message.fetch()
         view = ui.View.from_message(message)
         for choice_button in view.children:
             assert isinstance(choice_button, ui.Button)
             choice_button.disabled = True
-        self.prediction_message = await message.edit(view=view)
+        if final_totals:
+            [embed] = message.embeds
+            self.prediction_message = await message.edit(
+                embed=self.info.make_embed(embed), view=view
+            )
+        else:
+            self.prediction_message = await message.edit(view=view)
 
         assert message.thread is not None
         await message.thread.send("Prediction closed!")
@@ -164,7 +392,9 @@ class PayoutButton(ui.Button):
         super().__init__(label=f"Payout {self.choice_label}")
 
     async def callback(self, interaction: Interaction):
-        result = db.pay_out_prediction(self.info.message.id, self.winner)
+        result = await to_thread(
+            db.pay_out_prediction, self.info.message.id, self.winner
+        )
         match result:
             case "prediction has already been paid out":
                 await interaction.response.send_message(result, ephemeral=True)
@@ -205,7 +435,7 @@ class RefundButon(ui.Button):
         super().__init__(label="Refund")
 
     async def callback(self, interaction: Interaction):
-        result = db.refund_prediction(self.info.message.id)
+        result = await to_thread(db.refund_prediction, self.info.message.id)
 
         match result:
             case "prediction has already been paid out":